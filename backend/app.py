@@ -1,11 +1,24 @@
+import csv
+import hashlib
+import io
+import json
 import os
-from flask import Flask, jsonify, request
+import sys
+import zlib
+from datetime import datetime
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Boolean, ForeignKey, Index, DateTime, Float, func, case, select
 from sqlalchemy.orm import relationship
 
+# Let the backend's own modules resolve when app.py is imported as backend.app (e.g. from library.py)
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from llm_service import execute_prompt_improvement
+from db_config import configure_engine, default_database_url, engine_options
+from migrations import hash_prompt, sync_id_sequence, upgrade_database
+from prompt_templates import template_variables
+from jobs import JobManager, FINISHED_STATUSES
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 print(basedir)
@@ -14,13 +27,16 @@ db = SQLAlchemy()
 
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] =\
-        'sqlite:///' + os.path.join(basedir, 'database.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = default_database_url(basedir)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
-CORS(app)
 with app.app_context():
-    db.create_all()
+    # WAL, synchronous=NORMAL and a busy timeout on every SQLite connection, so concurrent loggers and the API don't lock each other out
+    configure_engine(db.engine)
+CORS(app)
+# Prompt improvements run here instead of on request threads
+improvement_jobs = JobManager(max_workers=int(os.environ.get('IMPROVEMENT_WORKERS', 4)))
 
 def add_sample_data():
     with app.app_context():
@@ -44,6 +60,11 @@ def add_sample_data():
                 process_id=1
             )
             db.session.add(sample_prompt)
+            # Reserve process_id 1 for the sample data so the first real run gets a fresh id
+            if db.session.get(Run, 1) is None:
+                db.session.add(Run(id=1, started_at=datetime.utcnow(), run_metadata=json.dumps({"sample_data": True})))
+                db.session.flush()
+                sync_id_sequence(db.session.connection(), 'runs')
             db.session.flush()  # This will assign an ID to sample_prompt
 
             # Check if sample test case already exists
@@ -80,6 +101,22 @@ class TestCase(db.Model):
     how_to_evaluate = Column(String)
     prompt_id = Column(Integer, ForeignKey('prompts.id'))  # New field for the relationship
     prompt = relationship("Prompt", back_populates="test_cases")  # Relationship to Prompt
+    # Per-call metrics, filled in by the logger when available
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    latency_ms = Column(Float)
+    prompt_tokens = Column(Integer)
+    completion_tokens = Column(Integer)
+    # Streamed calls only: time to the first chunk, and the mean / largest gap between chunks
+    ttft_ms = Column(Float)
+    mean_inter_token_ms = Column(Float)
+    max_inter_token_ms = Column(Float)
+
+    __table_args__ = (
+        Index('ix_test_cases_process_id_agent_name', 'process_id', 'agent_name'),  # save_output lookup
+        Index('ix_test_cases_agent_name_prompt_id', 'agent_name', 'prompt_id'),  # evaluation / reliability
+        Index('ix_test_cases_prompt_id_is_correct', 'prompt_id', 'is_correct'),  # API filters
+    )
 
     def __repr__(self):
         return f'<TestCase {self.id}, {self.input}, {self.output}, {self.is_correct}, {self.reason}>'
@@ -91,6 +128,10 @@ class EvaluateOrNot(db.Model):
     is_evaluate = Column(Boolean)
     evaluation_id = Column(Integer)
 
+def prompt_variables_json(prompt):
+    variables = template_variables(prompt or '')
+    return json.dumps(variables) if variables is not None else None
+
 class Prompt(db.Model):
     __tablename__ = 'prompts'
     id = Column(Integer, primary_key=True)
@@ -98,29 +139,108 @@ class Prompt(db.Model):
     agent_name = Column(String)
     model_name = Column(String)
     process_id = Column(Integer)
+    # sha256 of the stripped prompt text, filled in automatically so dedup never compares full prompts
+    prompt_hash = Column(String(64), default=lambda context: hash_prompt(context.get_current_parameters()['prompt']))
+    # JSON list of the template placeholders the prompt uses, or NULL when it is not a valid template
+    variables = Column(String, default=lambda context: prompt_variables_json(context.get_current_parameters()['prompt']))
     test_cases = relationship("TestCase", back_populates="prompt")  # Relationship to TestCase
 
+    __table_args__ = (
+        Index('ix_prompts_agent_name_prompt_hash', 'agent_name', 'prompt_hash'),
+    )
+
+# One row per test process; its id is the process_id used by that process's test cases and prompts.
+# AUTOINCREMENT keeps ids from ever being reused, even after the latest run is deleted.
+class Run(db.Model):
+    __tablename__ = 'runs'
+    id = Column(Integer, primary_key=True)
+    started_at = Column(DateTime)
+    ended_at = Column(DateTime)
+    run_metadata = Column('metadata', String)  # JSON
+
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    def __repr__(self):
+        return f'<Run {self.id}, {self.started_at}, {self.ended_at}>'
+
+# Checkpoint of one evaluation of a prompt's outputs: its parameters, so it can be resumed by id, and its progress.
+class EvaluationRun(db.Model):
+    __tablename__ = 'evaluation_runs'
+    id = Column(Integer, primary_key=True)
+    prompt_id = Column(Integer, ForeignKey('prompts.id'))
+    agent_name = Column(String)
+    how_to_evaluate = Column(String)
+    status = Column(String)  # running, done or failed
+    total = Column(Integer)
+    completed = Column(Integer)
+    error = Column(String)
+    started_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f'<EvaluationRun {self.id}, {self.prompt_id}, {self.status}, {self.completed}/{self.total}>'
+
+def init_database():
+    # Create missing tables, then upgrade an existing database.db to the latest schema version
+    db.create_all()
+    upgrade_database(db.engine)
+
+with app.app_context():
+    init_database()
+
 @app.route("/")
 def index():
     return "Hello, World!"
 
 
+TEST_CASE_FIELDS = ['id', 'input', 'output', 'is_correct', 'reason', 'agent_name', 'prompt_id', 'process_id',
+                    'ground_truth', 'how_to_evaluate', 'latency_ms', 'prompt_tokens', 'completion_tokens',
+                    'ttft_ms', 'mean_inter_token_ms', 'max_inter_token_ms']
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+def parse_bool_arg(value):
+    if value is None:
+        return None
+    return value.lower() in ('1', 'true', 'yes')
+
+def paginate_test_cases(query_filters, default_fields):
+    # Keyset pagination over test_cases ordered by id.
+    # ?limit=&after_id= page through results, ?fields=a,b selects columns, ?is_correct=&agent_name= filter server side.
+    limit = max(1, min(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    after_id = request.args.get('after_id', type=int)
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f in TEST_CASE_FIELDS] if fields else list(default_fields)
+    if 'id' not in fields:
+        fields.insert(0, 'id')
+
+    query = db.session.query(*[getattr(TestCase, f) for f in fields]).filter(*query_filters)
+    is_correct = parse_bool_arg(request.args.get('is_correct'))
+    if is_correct is not None:
+        query = query.filter(TestCase.is_correct.is_(is_correct))
+    agent_name = request.args.get('agent_name')
+    if agent_name:
+        query = query.filter(TestCase.agent_name == agent_name)
+    if after_id is not None:
+        query = query.filter(TestCase.id > after_id)
+
+    rows = query.order_by(TestCase.id).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        'test_cases': [dict(zip(fields, row)) for row in rows],
+        'next_cursor': rows[-1].id if has_more else None
+    }
+
 @app.route("/input-output", methods=["GET"])
 def get_test_cases():
-    test_cases = TestCase.query.all()
-    result = [
-        {
-            'id': test_case.id,
-            'input': test_case.input,
-            'output': test_case.output,
-            'is_correct': test_case.is_correct,
-            'reason': test_case.reason,
-            'ground_truth': test_case.ground_truth,
-            'how_to_evaluate': test_case.how_to_evaluate
-        }
-        for test_case in test_cases
-    ]
-    return jsonify(result)
+    return jsonify(paginate_test_cases([], ['id', 'input', 'output', 'is_correct', 'reason', 'ground_truth', 'how_to_evaluate']))
+
+@app.route("/testcase/<int:id>", methods=["GET"])
+def get_test_case(id):
+    test_case = TestCase.query.get_or_404(id)
+    return jsonify({field: getattr(test_case, field) for field in TEST_CASE_FIELDS})
 
 @app.route("/testcase/<int:id>", methods=["DELETE"])
 def delete_test_case(id):
@@ -163,7 +283,8 @@ def get_prompts():
             'prompt': prompt.prompt,
             'prompt_name': prompt.agent_name,
             'model_name': prompt.model_name,
-            'process_id': prompt.process_id
+            'process_id': prompt.process_id,
+            'variables': json.loads(prompt.variables) if prompt.variables else None
         }
         for prompt in prompts
     ]
@@ -171,34 +292,85 @@ def get_prompts():
 
 @app.route("/prompts/<int:prompt_id>/testcases", methods=["GET"])
 def get_testcases_by_prompt(prompt_id):
-    test_cases = TestCase.query.filter_by(prompt_id=prompt_id).all()
-    result = [
-        {
-            'id': test_case.id,
-            'input': test_case.input,
-            'output': test_case.output,
-            'is_correct': test_case.is_correct,
-            'reason': test_case.reason,
-            'prompt_id': test_case.prompt_id,
-            'ground_truth': test_case.ground_truth,
-            'how_to_evaluate': test_case.how_to_evaluate
-        }
-        for test_case in test_cases
-    ]
+    response = paginate_test_cases([TestCase.prompt_id == prompt_id], ['id', 'input', 'output', 'is_correct', 'reason', 'prompt_id', 'ground_truth', 'how_to_evaluate'])
     
-    # Calculate the percentage of correct test cases
-    total_cases = len(test_cases)
-    correct_cases = sum(1 for test_case in test_cases if test_case.is_correct)
+    # Calculate the percentage of correct test cases over the whole prompt, not just this page
+    total_cases, correct_cases = db.session.query(
+        func.count(TestCase.id),
+        func.coalesce(func.sum(case((TestCase.is_correct.is_(True), 1), else_=0)), 0)
+    ).filter(TestCase.prompt_id == prompt_id).one()
     percent_correct = (correct_cases / total_cases) * 100 if total_cases > 0 else 0
     
     # Add the percentage to the response
-    response = {
-        'test_cases': result,
-        'percent_correct': round(percent_correct, 2)
-    }
+    response['percent_correct'] = round(percent_correct, 2)
+    response['total_cases'] = total_cases
     
     return jsonify(response)
 
+def latency_percentile(prompt_id, percentile, count, column=TestCase.latency_ms):
+    # Nearest-rank percentile of a timing column (latency_ms by default) for a prompt, picked by the database with ORDER BY / OFFSET
+    if not count:
+        return None
+    offset = int(round((count - 1) * percentile / 100))
+    return db.session.query(column)\
+        .filter(TestCase.prompt_id == prompt_id, column.isnot(None))\
+        .order_by(column).offset(offset).limit(1).scalar()
+
+def metrics_columns():
+    return (
+        func.count(TestCase.id).label('total_cases'),
+        func.coalesce(func.sum(case((TestCase.is_correct.is_(True), 1), else_=0)), 0).label('correct_cases'),
+        func.count(TestCase.latency_ms).label('timed_cases'),
+        func.avg(TestCase.latency_ms).label('avg_latency_ms'),
+        func.max(TestCase.latency_ms).label('max_latency_ms'),
+        func.count(TestCase.ttft_ms).label('streamed_cases'),
+        func.avg(TestCase.ttft_ms).label('avg_ttft_ms'),
+        func.avg(TestCase.mean_inter_token_ms).label('avg_inter_token_ms'),
+        func.avg(TestCase.prompt_tokens).label('avg_prompt_tokens'),
+        func.avg(TestCase.completion_tokens).label('avg_completion_tokens'),
+        func.sum(func.coalesce(TestCase.prompt_tokens, 0) + func.coalesce(TestCase.completion_tokens, 0)).label('total_tokens'),
+        func.min(TestCase.started_at).label('first_call_at'),
+        func.max(TestCase.started_at).label('last_call_at'),
+    )
+
+def serialize_metrics(row):
+    percent_correct = (row.correct_cases / row.total_cases) * 100 if row.total_cases else 0
+    return {
+        'total_cases': row.total_cases,
+        'percent_correct': round(percent_correct, 2),
+        'timed_cases': row.timed_cases,
+        'avg_latency_ms': round(row.avg_latency_ms, 2) if row.avg_latency_ms is not None else None,
+        'max_latency_ms': row.max_latency_ms,
+        'streamed_cases': row.streamed_cases,
+        'avg_ttft_ms': round(row.avg_ttft_ms, 2) if row.avg_ttft_ms is not None else None,
+        'avg_inter_token_ms': round(row.avg_inter_token_ms, 2) if row.avg_inter_token_ms is not None else None,
+        'avg_prompt_tokens': row.avg_prompt_tokens,
+        'avg_completion_tokens': row.avg_completion_tokens,
+        'total_tokens': row.total_tokens or 0,
+        'first_call_at': row.first_call_at.isoformat() if row.first_call_at else None,
+        'last_call_at': row.last_call_at.isoformat() if row.last_call_at else None,
+    }
+
+@app.route("/prompts/metrics", methods=["GET"])
+def get_prompts_metrics():
+    rows = db.session.query(TestCase.prompt_id, *metrics_columns()).group_by(TestCase.prompt_id).all()
+    result = []
+    for row in rows:
+        metrics = serialize_metrics(row)
+        metrics['prompt_id'] = row.prompt_id
+        result.append(metrics)
+    return jsonify(result)
+
+@app.route("/prompts/<int:prompt_id>/metrics", methods=["GET"])
+def get_prompt_metrics(prompt_id):
+    row = db.session.query(*metrics_columns()).filter(TestCase.prompt_id == prompt_id).one()
+    metrics = serialize_metrics(row)
+    metrics['prompt_id'] = prompt_id
+    for percentile in (50, 90, 99):
+        metrics[f'p{percentile}_latency_ms'] = latency_percentile(prompt_id, percentile, row.timed_cases)
+        metrics[f'p{percentile}_ttft_ms'] = latency_percentile(prompt_id, percentile, row.streamed_cases, TestCase.ttft_ms)
+    return jsonify(metrics)
+
 @app.route("/prompts/<int:prompt_id>", methods=["DELETE"])
 def delete_prompt(prompt_id):
     prompt = Prompt.query.get_or_404(prompt_id)
@@ -212,30 +384,170 @@ def delete_prompt(prompt_id):
     
     return jsonify({"message": f"Prompt with id {prompt_id} and its associated test cases have been deleted"}), 200
 
-@app.route("/prompts/<int:prompt_id>/improve", methods=["GET"])
-def get_incorrect_reasons(prompt_id):
-    # Fetch all test cases for the given prompt_id where is_correct is False
-    incorrect_test_cases = TestCase.query.filter_by(prompt_id=prompt_id, is_correct=False).all()
+def run_prompt_improvement(prompt_text, incorrect_reasons):
+    return {"improved_prompt": execute_prompt_improvement(prompt_text, incorrect_reasons)}
 
-    # Fetch the prompt for the given prompt_id
+@app.route("/prompts/<int:prompt_id>/improve", methods=["POST"])
+def get_incorrect_reasons(prompt_id):
+    # Starts (or joins) a prompt improvement job and returns its id right away; poll /jobs/<job_id> or
+    # subscribe to /jobs/<job_id>/events for the result.
     prompt = Prompt.query.get_or_404(prompt_id)
     
-    # Check if the prompt exists
-    if not prompt:
-        return jsonify({"error": f"Prompt with id {prompt_id} not found"}), 404
-    
     # Extract the prompt text from the prompt object
     prompt_text = prompt.prompt
     
     # Extract reasons from incorrect test cases
-    incorrect_reasons = [test_case.reason for test_case in incorrect_test_cases if test_case.reason]
+    incorrect_reasons = [reason for (reason,) in db.session.query(TestCase.reason).filter(
+        TestCase.prompt_id == prompt_id, TestCase.is_correct.is_(False), TestCase.reason.isnot(None), TestCase.reason != ''
+    )]
 
-    improved_prompt = execute_prompt_improvement(prompt_text, incorrect_reasons)
+    # Identical (prompt, reasons) requests share one job while it is still running
+    job_key = hashlib.sha256('\0'.join([prompt_text] + sorted(incorrect_reasons)).encode('utf-8')).hexdigest()
+    job, created = improvement_jobs.submit(job_key, run_prompt_improvement, prompt_text, incorrect_reasons)
     
+    response = job.to_dict()
+    response['coalesced'] = not created
+    return jsonify(response), 202
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = improvement_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+@app.route("/evaluation-runs/<int:run_id>", methods=["GET"])
+def get_evaluation_run(run_id):
+    run = db.session.get(EvaluationRun, run_id)
+    if run is None:
+        return jsonify({"error": f"Evaluation run {run_id} not found"}), 404
     return jsonify({
-        "improved_prompt": improved_prompt
+        'id': run.id,
+        'prompt_id': run.prompt_id,
+        'agent_name': run.agent_name,
+        'how_to_evaluate': run.how_to_evaluate,
+        'status': run.status,
+        'total': run.total,
+        'completed': run.completed,
+        'error': run.error,
+        'started_at': export_value(run.started_at),
+        'updated_at': export_value(run.updated_at),
+        'finished_at': export_value(run.finished_at),
     }), 200
 
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+def stream_job_events(job_id):
+    # Server-sent events: one "status" event per change, ending with the finished job.
+    job = improvement_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job {job_id} not found"}), 404
+
+    def generate():
+        seen_version = -1
+        while True:
+            if job.version > seen_version:
+                seen_version = job.version
+                yield f"event: status\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.status in FINISHED_STATUSES:
+                    return
+            elif not improvement_jobs.wait_for_change(job, seen_version):
+                # Keep idle connections alive through proxies
+                yield ": keep-alive\n\n"
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+EXPORT_BATCH_ROWS = 1000
+EXPORT_TEST_CASE_FIELDS = TEST_CASE_FIELDS + ['started_at', 'finished_at']
+PROMPT_FIELDS = ['id', 'prompt', 'agent_name', 'model_name', 'process_id', 'prompt_hash', 'variables']
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def stream_rows(statement, fields, export_format, compress):
+    # Rows are pulled through a server-side cursor (yield_per) and written out in batches,
+    # so memory stays flat and the first bytes leave as soon as the first batch is read.
+    compressor = zlib.compressobj(wbits=31) if compress else None  # wbits=31 -> gzip container
+
+    def encode(text):
+        if compressor is None:
+            return text.encode('utf-8')
+        return compressor.compress(text.encode('utf-8')) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if export_format == 'csv' else None
+        if writer:
+            writer.writerow(fields)
+        rows = db.session.execute(statement.execution_options(yield_per=EXPORT_BATCH_ROWS))
+        for batch in rows.partitions():
+            for row in batch:
+                values = [export_value(value) for value in row]
+                if writer:
+                    writer.writerow(values)
+                else:
+                    buffer.write(json.dumps(dict(zip(fields, values))) + '\n')
+            yield encode(buffer.getvalue())
+            buffer.seek(0)
+            buffer.truncate()
+        if writer and buffer.tell():
+            yield encode(buffer.getvalue())
+        if compressor is not None:
+            yield compressor.flush()
+
+    mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+def export_options():
+    export_format = request.args.get('format', 'ndjson')
+    if export_format not in ('ndjson', 'csv'):
+        return None, None, (jsonify({"error": "format must be ndjson or csv"}), 400)
+    return export_format, parse_bool_arg(request.args.get('gzip')), None
+
+@app.route("/export/test-cases", methods=["GET"])
+def export_test_cases():
+    # Streams test cases as NDJSON (default) or CSV. Filters: prompt_id, agent_name,
+    # process_id_min/process_id_max and since/until (ISO timestamps on started_at). ?gzip=1 compresses the stream.
+    export_format, compress, error = export_options()
+    if error:
+        return error
+    fields = request.args.get('fields')
+    fields = [f for f in fields.split(',') if f in EXPORT_TEST_CASE_FIELDS] if fields else EXPORT_TEST_CASE_FIELDS
+
+    statement = select(*[getattr(TestCase, f) for f in fields])
+    try:
+        if request.args.get('prompt_id') is not None:
+            statement = statement.where(TestCase.prompt_id == int(request.args['prompt_id']))
+        if request.args.get('process_id_min') is not None:
+            statement = statement.where(TestCase.process_id >= int(request.args['process_id_min']))
+        if request.args.get('process_id_max') is not None:
+            statement = statement.where(TestCase.process_id <= int(request.args['process_id_max']))
+    except ValueError:
+        return jsonify({"error": "prompt_id/process_id_min/process_id_max must be integers"}), 400
+    if request.args.get('agent_name'):
+        statement = statement.where(TestCase.agent_name == request.args['agent_name'])
+    try:
+        if request.args.get('since'):
+            statement = statement.where(TestCase.started_at >= datetime.fromisoformat(request.args['since']))
+        if request.args.get('until'):
+            statement = statement.where(TestCase.started_at < datetime.fromisoformat(request.args['until']))
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO 8601 timestamps"}), 400
+
+    return stream_rows(statement.order_by(TestCase.id), fields, export_format, compress)
+
+@app.route("/export/prompts", methods=["GET"])
+def export_prompts():
+    export_format, compress, error = export_options()
+    if error:
+        return error
+    statement = select(*[getattr(Prompt, f) for f in PROMPT_FIELDS])
+    if request.args.get('agent_name'):
+        statement = statement.where(Prompt.agent_name == request.args['agent_name'])
+    return stream_rows(statement.order_by(Prompt.id), PROMPT_FIELDS, export_format, compress)
 
 
 if __name__ == "__main__":
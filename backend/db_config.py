@@ -0,0 +1,50 @@
+import os
+
+from sqlalchemy import event
+
+
+def default_database_url(basedir: str) -> str:
+    # DATABASE_URL points the backend at a server database (e.g. postgresql://...) instead of the local SQLite file.
+    return os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(basedir, 'database.db')
+
+
+def is_sqlite_url(url: str) -> bool:
+    return str(url).startswith('sqlite')
+
+
+# Engine options for SQLALCHEMY_ENGINE_OPTIONS / create_engine.
+# SQLite connections are shared across the logger's worker threads, so the same-thread check is turned off;
+# every database gets a pool sized for a few concurrent writers plus the API.
+def engine_options(url: str) -> dict:
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    }
+    if is_sqlite_url(url):
+        if ':memory:' in str(url) or str(url) in ('sqlite://', 'sqlite:///'):
+            # An in-memory database only exists on its own connection, so it cannot be pooled.
+            return {'connect_args': {'check_same_thread': False}}
+        options['connect_args'] = {'check_same_thread': False}
+    else:
+        options['pool_pre_ping'] = True
+        options['pool_recycle'] = 1800
+    return options
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets the API read while loggers write, and lets writers from several processes queue up instead of failing.
+    # synchronous=NORMAL is durable in WAL mode except for the last transactions on power loss, and avoids an fsync per commit.
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')}")
+    cursor.execute(f"PRAGMA synchronous={os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')}")
+    cursor.execute(f"PRAGMA busy_timeout={int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+# Applies the SQLite tuning to every new connection of the engine; server databases are left as they are.
+def configure_engine(engine):
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', set_sqlite_pragmas)
+    return engine
@@ -0,0 +1,86 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+FINISHED_STATUSES = ("done", "failed")
+
+
+class Job:
+    def __init__(self, key: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        # Bumped on every status change so event streams can wait for the next one.
+        self.version = 0
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+# Runs slow work (LLM calls) on a small worker pool instead of on request threads.
+# Submitting a key that already has a queued or running job returns that job instead of starting another one.
+class JobManager:
+    def __init__(self, max_workers: int = 4, keep_finished_seconds: float = 3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.keep_finished_seconds = keep_finished_seconds
+        self.jobs = {}
+        self.active_by_key = {}
+        self.changed = threading.Condition()
+
+    def submit(self, key: str, function, *args, **kwargs) -> tuple:
+        with self.changed:
+            self.prune()
+            active_job = self.active_by_key.get(key)
+            if active_job is not None:
+                return active_job, False
+            job = Job(key)
+            self.jobs[job.id] = job
+            self.active_by_key[key] = job
+        self.executor.submit(self.run, job, function, args, kwargs)
+        return job, True
+
+    def run(self, job: Job, function, args, kwargs):
+        self.update(job, status="running")
+        try:
+            result = function(*args, **kwargs)
+        except Exception as error:
+            self.update(job, status="failed", error=str(error))
+        else:
+            self.update(job, status="done", result=result)
+
+    def update(self, job: Job, **changes):
+        with self.changed:
+            for name, value in changes.items():
+                setattr(job, name, value)
+            job.updated_at = time.time()
+            job.version += 1
+            if job.status in FINISHED_STATUSES and self.active_by_key.get(job.key) is job:
+                del self.active_by_key[job.key]
+            self.changed.notify_all()
+
+    def get(self, job_id: str):
+        with self.changed:
+            return self.jobs.get(job_id)
+
+    def wait_for_change(self, job: Job, seen_version: int, timeout: float = 15.0) -> bool:
+        # Blocks until the job moves past seen_version or the timeout passes; returns whether it changed.
+        with self.changed:
+            return self.changed.wait_for(lambda: job.version > seen_version, timeout=timeout)
+
+    def prune(self):
+        # Caller must hold self.changed.
+        cutoff = time.time() - self.keep_finished_seconds
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.status in FINISHED_STATUSES and job.updated_at < cutoff]:
+            del self.jobs[job_id]
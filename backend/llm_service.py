@@ -1,10 +1,11 @@
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
+import hashlib
 import os
-from dotenv import load_dotenv
+import random
+import re
 
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from providers import get_provider
 
 
 all_prompt = {
@@ -26,28 +27,147 @@ Support requests for urgent issues (as defined in Understanding Case Priority an
 Targets) can be submitted at any time via our support portal or via email to urgent@marklogic.com.
 """
 
-SAFETY_SETTINGS =  {
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+# Models are resolved through the shared provider layer (providers.py) on first use, so importing this module
+# (and backend/app.py, and library.py) stays fast and works offline / without API keys.
+# LLM_SERVICE_PROVIDER=mock swaps every model for the offline mock provider.
+MODELS = {
+    "dumbest": ("gemini", "gemini-1.5-flash-8b"),
+    "flash": ("gemini", "gemini-1.5-flash"),
+    "pro": ("gemini", "gemini-1.5-pro-latest"),
 }
 
-load_dotenv()
+def get_model(alias: str):
+    provider, model_name = MODELS[alias]
+    return get_provider(os.environ.get("LLM_SERVICE_PROVIDER", provider), model_name)
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+# Reasons are collapsed and trimmed to this many (estimated) tokens before they go into the improvement prompt.
+REASON_TOKEN_BUDGET = int(os.environ.get("REASON_TOKEN_BUDGET", 4000))
+# Estimated Jaccard similarity above which two reasons count as the same failure.
+REASON_SIMILARITY_THRESHOLD = 0.8
+# Summarization rounds prepare_reasons may spend before it truncates what is left.
+MAX_REASON_SUMMARY_ROUNDS = 3
 
-dumbest_gemini_model = genai.GenerativeModel("gemini-1.5-flash-8b")
-gemini_flash = genai.GenerativeModel("gemini-1.5-flash")
-gemini_pro = genai.GenerativeModel("gemini-1.5-pro-latest")
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16  # 16 bands x 4 rows: pairs above ~0.6 similarity almost always share a bucket
+MINHASH_PRIME = (1 << 61) - 1
+_minhash_random = random.Random(1234)
+MINHASH_COEFFICIENTS = [(_minhash_random.randrange(1, MINHASH_PRIME), _minhash_random.randrange(0, MINHASH_PRIME)) for _ in range(MINHASH_PERMUTATIONS)]
 
-def construct_prompt_for_improvement(reasons: list[str], prompt: str):
+
+def estimate_tokens(text: str) -> int:
+    # Rough count (~4 characters per token); good enough for budgeting without a tokenizer.
+    return len(text) // 4 + 1
+
+def normalize_reason(reason: str) -> str:
+    reason = reason.lower()
+    reason = re.sub(r"\d+", "0", reason)
+    reason = re.sub(r"[^\w\s]", " ", reason)
+    return " ".join(reason.split())
+
+def minhash_signature(normalized: str) -> list:
+    words = normalized.split()
+    shingles = {" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))}
+    hashes = [int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles]
+    return [min((a * h + b) % MINHASH_PRIME for h in hashes) for a, b in MINHASH_COEFFICIENTS]
+
+def deduplicate_reasons(reasons: list[str], similarity_threshold: float = REASON_SIMILARITY_THRESHOLD) -> list[tuple[str, int]]:
+    # Collapses exact duplicates (after normalization) and then near-duplicates (MinHash + LSH banding).
+    # Returns (representative reason, count) pairs, most frequent first.
+    exact_groups = {}
+    for reason in reasons:
+        if reason and reason.strip():
+            exact_groups.setdefault(normalize_reason(reason), []).append(reason.strip())
+    keys = list(exact_groups)
+    signatures = [minhash_signature(key) for key in keys]
+
+    # Union-find over exact groups that land in the same LSH bucket and are similar enough
+    parent = list(range(len(keys)))
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    rows_per_band = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    for band in range(MINHASH_BANDS):
+        buckets = {}
+        for index, signature in enumerate(signatures):
+            bucket = tuple(signature[band * rows_per_band:(band + 1) * rows_per_band])
+            buckets.setdefault(bucket, []).append(index)
+        for members in buckets.values():
+            for other in members[1:]:
+                first_root, other_root = find(members[0]), find(other)
+                if first_root == other_root:
+                    continue
+                similarity = sum(x == y for x, y in zip(signatures[members[0]], signatures[other])) / MINHASH_PERMUTATIONS
+                if similarity >= similarity_threshold:
+                    parent[other_root] = first_root
+
+    clusters = {}
+    for index, key in enumerate(keys):
+        clusters.setdefault(find(index), []).append(exact_groups[key])
+    counted = []
+    for groups in clusters.values():
+        # The representative is the most common wording in the cluster
+        representative = max(groups, key=len)[0]
+        counted.append((representative, sum(len(group) for group in groups)))
+    return sorted(counted, key=lambda item: -item[1])
+
+def format_counted_reasons(counted_reasons: list[tuple[str, int]]) -> list[str]:
+    return [f"- ({count}x) {reason}" for reason, count in counted_reasons]
+
+def split_to_budget(lines: list[str], token_budget: int) -> list[list[str]]:
+    chunks, chunk, chunk_tokens = [], [], 0
+    for line in lines:
+        line_tokens = estimate_tokens(line)
+        if chunk and chunk_tokens + line_tokens > token_budget:
+            chunks.append(chunk)
+            chunk, chunk_tokens = [], 0
+        chunk.append(line[:token_budget * 4])
+        chunk_tokens += min(line_tokens, token_budget)
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+def summarize_reason_chunk(lines: list[str]) -> str:
+    summary = get_model("flash").generate(f"""
+        The following are reasons why test cases of an LLM prompt failed, with how often each occurred:
+        {chr(10).join(lines)}
+        Summarize them into a short list of distinct failure themes. Keep the occurrence counts (add them up when merging).
+        Use the same "- (Nx) theme" format, one theme per line, most frequent first.
+        """)
+    return summary.text.strip()
+
+def prepare_reasons(reasons: list[str], token_budget: int = None, max_rounds: int = MAX_REASON_SUMMARY_ROUNDS) -> str:
+    # Dedupes the failure reasons and fits them into token_budget, map-reduce summarizing when they don't fit,
+    # so the improvement prompt costs about the same for 10 failures as for 10,000.
+    # Summarizing stops after max_rounds, or as soon as a round does not shrink the reasons; what is left is truncated.
+    token_budget = token_budget or REASON_TOKEN_BUDGET
+    lines = format_counted_reasons(deduplicate_reasons(reasons))
+    tokens = sum(estimate_tokens(line) for line in lines)
+    for _ in range(max_rounds):
+        if tokens <= token_budget:
+            return "\n".join(lines)
+        chunks = split_to_budget(lines, token_budget)
+        summaries = [summarize_reason_chunk(chunk) for chunk in chunks]
+        summarized = [line for summary in summaries for line in summary.splitlines() if line.strip()]
+        summarized_tokens = sum(estimate_tokens(line) for line in summarized)
+        if summarized_tokens >= tokens:
+            break
+        lines, tokens = summarized, summarized_tokens
+        if len(chunks) == 1:
+            # Summary of a single chunk is as small as it gets
+            break
+    return "\n".join(split_to_budget(lines, token_budget)[0] if lines else lines)
+
+def construct_prompt_for_improvement(reasons: str, prompt: str):
     return f"""
         Your job is to improve the following prompt: {prompt}
-        The following test cases failed with a reason: {reasons}
+        The following test cases failed with a reason (with how many test cases failed for each reason): 
+        {reasons}
         Try your best to improve the prompt with concise and clear instructions so that the test cases pass the failed reasons.
         """
 
 def execute_prompt_improvement(prompt: str, reasons: list[str]):
-    improved_prompt = gemini_pro.generate_content(construct_prompt_for_improvement(reasons, prompt), safety_settings=SAFETY_SETTINGS)
+    improved_prompt = get_model("pro").generate(construct_prompt_for_improvement(prepare_reasons(reasons), prompt))
     return improved_prompt.text
@@ -0,0 +1,114 @@
+import hashlib
+import json
+
+from sqlalchemy import DateTime, Float, Integer, inspect, text
+
+
+def hash_prompt(prompt: str) -> str:
+    # Prompts are deduplicated on the hash of their stripped text, not on the full string.
+    return hashlib.sha256((prompt or "").strip().encode("utf-8")).hexdigest()
+
+
+# column_type is either a SQL type string or a SQLAlchemy type, compiled for the connected database.
+def add_column_if_missing(connection, table: str, column: str, column_type):
+    existing_columns = {c["name"] for c in inspect(connection).get_columns(table)}
+    if column not in existing_columns:
+        if not isinstance(column_type, str):
+            column_type = column_type.compile(dialect=connection.dialect)
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+
+
+# Version 1: columns older databases are missing, prompt hashes and the lookup indexes.
+def migration_1_indexes_and_prompt_hash(connection):
+    add_column_if_missing(connection, "test_cases", "how_to_evaluate", "VARCHAR")
+    add_column_if_missing(connection, "prompts", "prompt_hash", "VARCHAR(64)")
+
+    rows = connection.execute(text("SELECT id, prompt FROM prompts WHERE prompt_hash IS NULL")).fetchall()
+    for prompt_id, prompt in rows:
+        connection.execute(text("UPDATE prompts SET prompt_hash = :prompt_hash WHERE id = :id"), {"prompt_hash": hash_prompt(prompt), "id": prompt_id})
+
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_test_cases_process_id_agent_name ON test_cases (process_id, agent_name)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_test_cases_agent_name_prompt_id ON test_cases (agent_name, prompt_id)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_test_cases_prompt_id_is_correct ON test_cases (prompt_id, is_correct)"))
+    connection.execute(text("CREATE INDEX IF NOT EXISTS ix_prompts_agent_name_prompt_hash ON prompts (agent_name, prompt_hash)"))
+
+
+# Version 2: per-call timing and token metrics on test cases.
+def migration_2_call_metrics(connection):
+    add_column_if_missing(connection, "test_cases", "started_at", DateTime())
+    add_column_if_missing(connection, "test_cases", "finished_at", DateTime())
+    add_column_if_missing(connection, "test_cases", "latency_ms", Float())
+    add_column_if_missing(connection, "test_cases", "prompt_tokens", Integer())
+    add_column_if_missing(connection, "test_cases", "completion_tokens", Integer())
+
+
+# Rows inserted with explicit ids do not advance PostgreSQL's id sequence; move it past them so the next insert gets a fresh id.
+# SQLite (AUTOINCREMENT) and MySQL (AUTO_INCREMENT) already continue after the largest id.
+def sync_id_sequence(connection, table: str):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))"))
+
+
+# Version 3: the runs table hands out process ids. Its ids continue after the process ids already in use.
+# The table itself is created by db.create_all(), which runs before the migrations.
+def migration_3_runs(connection):
+    if connection.execute(text("SELECT COUNT(*) FROM runs")).scalar():
+        return
+    last_process_id = connection.execute(text(
+        "SELECT MAX(process_id) FROM (SELECT process_id FROM test_cases UNION ALL SELECT process_id FROM prompts) AS process_ids"
+    )).scalar()
+    if last_process_id:
+        connection.execute(
+            text("INSERT INTO runs (id, metadata) VALUES (:id, :metadata)"),
+            {"id": last_process_id, "metadata": json.dumps({"reserved": "process ids used before runs were recorded"})}
+        )
+        sync_id_sequence(connection, "runs")
+
+
+# Version 4: template variables used by each prompt, as a JSON list.
+def migration_4_prompt_variables(connection):
+    from prompt_templates import template_variables
+
+    add_column_if_missing(connection, "prompts", "variables", "VARCHAR")
+    rows = connection.execute(text("SELECT id, prompt FROM prompts WHERE variables IS NULL")).fetchall()
+    for prompt_id, prompt in rows:
+        variables = template_variables(prompt or "")
+        if variables is not None:
+            connection.execute(text("UPDATE prompts SET variables = :variables WHERE id = :id"), {"variables": json.dumps(variables), "id": prompt_id})
+
+
+# Version 5: streaming metrics per call (time to first token and the gaps between chunks), filled in by stream_output.
+def migration_5_streaming_metrics(connection):
+    add_column_if_missing(connection, "test_cases", "ttft_ms", Float())
+    add_column_if_missing(connection, "test_cases", "mean_inter_token_ms", Float())
+    add_column_if_missing(connection, "test_cases", "max_inter_token_ms", Float())
+
+
+# Ordered list of (version, migration). Append new steps at the end; never edit a released one.
+MIGRATIONS = [
+    (1, migration_1_indexes_and_prompt_hash),
+    (2, migration_2_call_metrics),
+    (3, migration_3_runs),
+    (4, migration_4_prompt_variables),
+    (5, migration_5_streaming_metrics),
+]
+
+
+def get_schema_version(connection) -> int:
+    connection.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = connection.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+# Brings an existing database up to the latest schema in place. Each step runs in its own transaction.
+def upgrade_database(engine):
+    with engine.begin() as connection:
+        current_version = get_schema_version(connection)
+
+    for version, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {"version": version})
+        print(f"Applied database migration {version}: {migration.__name__}")
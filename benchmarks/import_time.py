@@ -0,0 +1,34 @@
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Imports measured in a fresh interpreter each time, with no API keys set, to check startup is fast and offline-safe.
+STATEMENTS = {
+    "from library import LLMLogger": "from library import LLMLogger",
+    "backend.app (Flask startup)": "import backend.app",
+    "backend.llm_service": "sys.path.insert(0, 'backend'); import llm_service",
+}
+
+
+def time_import(statement: str, runs: int) -> list:
+    code = f"import sys, time; start = time.perf_counter(); {statement}; print(time.perf_counter() - start)"
+    env = {k: v for k, v in os.environ.items() if k not in ("GEMINI_API_KEY", "OPENAI_API_KEY")}
+    timings = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+        timings.append(float(output.strip().splitlines()[-1]) * 1000)
+    return timings
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    for name, statement in STATEMENTS.items():
+        timings = time_import(statement, runs)
+        print(f"{name:<35} median {statistics.median(timings):8.1f} ms   min {min(timings):8.1f} ms   ({runs} runs)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import OperationalError
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(ROOT, 'backend'))
+from db_config import configure_engine, engine_options
+
+# Several logger processes insert test cases one transaction at a time while an API-like reader keeps counting them,
+# once against an untuned SQLite engine and once with the backend's tuning profile.
+CREATE_TABLE = """
+CREATE TABLE test_cases (
+    id INTEGER PRIMARY KEY,
+    process_id INTEGER,
+    input VARCHAR,
+    output VARCHAR,
+    agent_name VARCHAR,
+    prompt_id INTEGER
+)
+"""
+
+
+def make_engine(url: str, profile: str):
+    if profile == "default":
+        return create_engine(url)
+    return configure_engine(create_engine(url, **engine_options(url)))
+
+
+def writer(url: str, profile: str, process_id: int, rows: int, batch_size: int, results):
+    engine = make_engine(url, profile)
+    written, errors = 0, 0
+    for batch_start in range(0, rows, batch_size):
+        batch = [
+            {"process_id": process_id, "input": f"input {process_id}-{i}", "output": "x" * 200, "agent_name": "benchmark", "prompt_id": 1}
+            for i in range(batch_start, min(batch_start + batch_size, rows))
+        ]
+        try:
+            with engine.begin() as connection:
+                connection.execute(text("INSERT INTO test_cases (process_id, input, output, agent_name, prompt_id) "
+                                        "VALUES (:process_id, :input, :output, :agent_name, :prompt_id)"), batch)
+            written += len(batch)
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    results.put((written, errors))
+
+
+def reader(url: str, profile: str, stop, results):
+    engine = make_engine(url, profile)
+    reads, errors = 0, 0
+    while not stop.is_set():
+        try:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT agent_name, COUNT(*) FROM test_cases GROUP BY agent_name")).fetchall()
+            reads += 1
+        except OperationalError:
+            errors += 1
+    engine.dispose()
+    results.put((reads, errors))
+
+
+def run_profile(profile: str, processes: int, rows: int, batch_size: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        url = "sqlite:///" + os.path.join(directory, "benchmark.db")
+        setup_engine = make_engine(url, profile)
+        with setup_engine.begin() as connection:
+            connection.execute(text(CREATE_TABLE))
+        setup_engine.dispose()
+
+        write_results, read_results = multiprocessing.Queue(), multiprocessing.Queue()
+        stop = multiprocessing.Event()
+        reader_process = multiprocessing.Process(target=reader, args=(url, profile, stop, read_results))
+        writers = [multiprocessing.Process(target=writer, args=(url, profile, process_id, rows, batch_size, write_results))
+                   for process_id in range(processes)]
+
+        reader_process.start()
+        started_at = time.perf_counter()
+        for process in writers:
+            process.start()
+        written, write_errors = 0, 0
+        for _ in writers:
+            process_written, process_errors = write_results.get()
+            written += process_written
+            write_errors += process_errors
+        seconds = time.perf_counter() - started_at
+        stop.set()
+        reads, read_errors = read_results.get()
+        for process in writers + [reader_process]:
+            process.join()
+
+    return {"rows": written, "seconds": seconds, "rows_per_second": written / seconds, "write_errors": write_errors,
+            "reads": reads, "read_errors": read_errors}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare multi-process SQLite write throughput with and without the backend's tuning profile.")
+    parser.add_argument("--processes", type=int, default=4, help="number of concurrent writer processes")
+    parser.add_argument("--rows", type=int, default=500, help="rows written by each process")
+    parser.add_argument("--batch-size", type=int, default=1, help="rows per transaction (1 matches the logger's commit per call)")
+    args = parser.parse_args()
+
+    print(f"{args.processes} writer processes x {args.rows} rows, {args.batch_size} row(s) per transaction, 1 reader")
+    for profile in ("default", "tuned"):
+        result = run_profile(profile, args.processes, args.rows, args.batch_size)
+        print(f"{profile:<8} {result['rows_per_second']:9.0f} rows/s  {result['seconds']:6.2f}s  "
+              f"write errors {result['write_errors']:<4} reads {result['reads']:<6} read errors {result['read_errors']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+import os
+import sys
+import timeit
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ROOT)
+from prompt_templates import compile_template
+
+
+def double_format(template: str, **kwargs) -> str:
+    # What fill_template did before templates were compiled
+    return template.format(**{k: '{' + k + '}' for k in kwargs.keys()}).format(**kwargs)
+
+
+# (name, template, variables): a Config-sized prompt with a large embedded doc, and a large template with many placeholders.
+CASES = [
+    (
+        "small template, 50 KB doc variable",
+        "You are a helpful customer support assistant that responds based on the documentation: {{DOC}}.\n"
+        "Respond politely to the user's message: {{user_message}}.",
+        {"DOC": "Lorem ipsum dolor sit amet. " * 1800, "user_message": "How can I reset my password?"},
+    ),
+    (
+        "20 KB template, 200 placeholders",
+        "".join(f"Section {i}: " + "static instructions " * 5 + f"{{{{value_{i}}}}}\n" for i in range(200)),
+        {f"value_{i}": f"v{i}" for i in range(200)},
+    ),
+]
+
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for name, template, variables in CASES:
+        assert double_format(template, **variables) == compile_template(template).render(**variables)
+        before = timeit.timeit(lambda: double_format(template, **variables), number=number) / number * 1e6
+        after = timeit.timeit(lambda: compile_template(template).render(**variables), number=number) / number * 1e6
+        print(f"{name:<36} double format {before:9.1f} us   compiled {after:9.1f} us   ({before / after:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import hashlib
+import json
+import time
+
+from sqlalchemy import insert, select
+
+from backend.app import app, db, TestCase
+
+
+def corpus_key(agent_name: str, input: str) -> bytes:
+    # Compact digest so the set of existing (agent_name, input) pairs stays small in memory.
+    return hashlib.sha1(f"{agent_name}\0{input}".encode("utf-8")).digest()
+
+
+# Keys of the (agent_name, input) pairs already stored, optionally for one agent only. Must be called inside an app context.
+def load_corpus_keys(agent_name: str = None) -> set:
+    statement = select(TestCase.agent_name, TestCase.input).where(TestCase.input.isnot(None))
+    if agent_name is not None:
+        statement = statement.where(TestCase.agent_name == agent_name)
+    return {corpus_key(row.agent_name, row.input) for row in db.session.execute(statement.execution_options(yield_per=10000))}
+
+
+def read_jsonl(path: str):
+    with open(path, encoding="utf-8") as corpus_file:
+        for line_number, line in enumerate(corpus_file, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skipping line {line_number}: not valid JSON")
+                yield None
+
+
+# Streams a JSONL file of {"input", "ground_truth", "agent_name", "how_to_evaluate"} records into test_cases.
+# Must be called inside an app context. Records already present for the same agent (or repeated in the file) are skipped.
+# Rows are inserted with batched core INSERTs and committed in a single transaction at the end.
+def import_corpus(path: str, agent_name: str = None, process_id: int = None, batch_size: int = 5000) -> dict:
+    started_at = time.perf_counter()
+    seen = load_corpus_keys()
+
+    stats = {"read": 0, "inserted": 0, "duplicates": 0, "skipped": 0}
+    batch = []
+    try:
+        for record in read_jsonl(path):
+            stats["read"] += 1
+            if not isinstance(record, dict) or not record.get("input"):
+                stats["skipped"] += 1
+                continue
+            record_agent_name = record.get("agent_name") or agent_name
+            key = corpus_key(record_agent_name, record["input"])
+            if key in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(key)
+            batch.append({
+                "process_id": process_id,
+                "input": record["input"],
+                "ground_truth": record.get("ground_truth"),
+                "how_to_evaluate": record.get("how_to_evaluate"),
+                "agent_name": record_agent_name,
+            })
+            if len(batch) >= batch_size:
+                db.session.execute(insert(TestCase), batch)
+                stats["inserted"] += len(batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(TestCase), batch)
+            stats["inserted"] += len(batch)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    stats["seconds"] = time.perf_counter() - started_at
+    stats["rows_per_second"] = stats["inserted"] / stats["seconds"] if stats["seconds"] else 0
+    print(f"Imported {stats['inserted']} test cases ({stats['duplicates']} duplicates, {stats['skipped']} skipped) "
+          f"in {stats['seconds']:.2f}s, {stats['rows_per_second']:.0f} rows/s")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import a JSONL corpus of test cases into the database.")
+    parser.add_argument("path", help="JSONL file with one {input, ground_truth, agent_name} object per line")
+    parser.add_argument("--agent-name", help="agent_name for records that do not set one")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args()
+
+    from library import LLMLogger
+
+    logger = LLMLogger(app)
+    logger.start_process_here()
+    logger.import_corpus(args.path, agent_name=args.agent_name, batch_size=args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
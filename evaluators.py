@@ -0,0 +1,219 @@
+import json
+import re
+
+# Evaluators decide test cases without a model. Each one takes the whole batch of rows ({"output", "ground_truth", ...})
+# and returns one verdict per row: (is_correct, reason), or None when it cannot tell and the row should move on.
+# Rows without an output (None) are always left to the judge.
+
+NEGATION_WORDS = frozenset({"not", "no", "never", "none", "nothing", "cannot", "can't", "don't", "doesn't", "isn't", "won't", "without"})
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(re.sub(r"[^\w\s']", " ", (text or "").casefold()).split())
+
+
+# Output equal to the ground truth, ignoring case, punctuation and whitespace. A mismatch only decides when decide_mismatch is set.
+class ExactMatch:
+    name = "exact match"
+
+    def __init__(self, decide_mismatch: bool = False):
+        self.decide_mismatch = decide_mismatch
+
+    def evaluate(self, rows: list) -> list:
+        verdicts = []
+        for row in rows:
+            if row.get("ground_truth") is None or row["output"] is None:
+                verdicts.append(None)
+            elif normalize_text(row["output"]) == normalize_text(row["ground_truth"]):
+                verdicts.append((True, None))
+            else:
+                verdicts.append((False, "Output does not match the ground truth") if self.decide_mismatch else None)
+        return verdicts
+
+
+# Word-overlap (Jaccard) similarity with the ground truth. Accepts above accept_above unless the texts differ in a negation,
+# rejects below reject_below when set; anything in between is left to the next evaluator.
+class LexicalSimilarity:
+    name = "lexical similarity"
+
+    def __init__(self, accept_above: float = 0.95, reject_below: float = None):
+        self.accept_above = accept_above
+        self.reject_below = reject_below
+
+    def evaluate(self, rows: list) -> list:
+        verdicts = []
+        for row in rows:
+            if row.get("ground_truth") is None or row["output"] is None:
+                verdicts.append(None)
+                continue
+            output_words = set(normalize_text(row["output"]).split())
+            truth_words = set(normalize_text(row["ground_truth"]).split())
+            union = output_words | truth_words
+            similarity = len(output_words & truth_words) / len(union) if union else 1.0
+            if self.accept_above is not None and similarity >= self.accept_above and not (output_words ^ truth_words) & NEGATION_WORDS:
+                verdicts.append((True, None))
+            elif self.reject_below is not None and similarity < self.reject_below:
+                verdicts.append((False, f"Output is too different from the ground truth (similarity {similarity:.2f})"))
+            else:
+                verdicts.append(None)
+        return verdicts
+
+
+# Base for structural checks. A check only decides rows when it is the whole evaluation (complete=True): a pass says
+# nothing about the rest of a partly parsed instruction, and a fail may come from misreading it ("not JSON").
+class Check:
+    name = "check"
+
+    def __init__(self, complete: bool = False):
+        self.complete = complete
+
+    def check(self, output: str):
+        # Returns None when the output passes, or the reason it fails.
+        raise NotImplementedError
+
+    def evaluate(self, rows: list) -> list:
+        if not self.complete:
+            return [None] * len(rows)
+        verdicts = []
+        for row in rows:
+            if row["output"] is None:
+                # An empty string would pass every length limit and "must not contain" check
+                verdicts.append(None)
+                continue
+            failure = self.check(row["output"])
+            verdicts.append((False, failure) if failure is not None else (True, None))
+        return verdicts
+
+
+class LengthCheck(Check):
+    name = "length"
+
+    def __init__(self, min_length: int = None, max_length: int = None, unit: str = "characters", complete: bool = False):
+        super().__init__(complete)
+        self.min_length = min_length
+        self.max_length = max_length
+        self.unit = unit
+
+    def check(self, output: str):
+        length = len(output.split()) if self.unit == "words" else len(output.strip())
+        if self.max_length is not None and length > self.max_length:
+            return f"Output is {length} {self.unit}, more than the allowed {self.max_length}"
+        if self.min_length is not None and length < self.min_length:
+            return f"Output is {length} {self.unit}, fewer than the required {self.min_length}"
+        return None
+
+
+class RegexCheck(Check):
+    name = "regex"
+
+    def __init__(self, pattern: str, must_match: bool = True, flags: int = re.IGNORECASE, complete: bool = False):
+        super().__init__(complete)
+        self.pattern = re.compile(pattern, flags)
+        self.must_match = must_match
+
+    def check(self, output: str):
+        if bool(self.pattern.search(output)) != self.must_match:
+            return f"Output {'does not match' if self.must_match else 'matches'} /{self.pattern.pattern}/"
+        return None
+
+
+class JSONCheck(Check):
+    name = "json"
+
+    def check(self, output: str):
+        try:
+            json.loads(output)
+        except ValueError:
+            return "Output is not valid JSON"
+        return None
+
+
+# Several checks that together make up the whole instruction: fails on the first failed check, passes when all pass.
+class AllChecks(Check):
+    name = "instruction"
+
+    def __init__(self, checks: list, complete: bool = False):
+        super().__init__(complete)
+        self.checks = checks
+
+    def check(self, output: str):
+        for check in self.checks:
+            failure = check.check(output)
+            if failure is not None:
+                return failure
+        return None
+
+
+# Runs evaluators in order over a batch; each one only sees the rows the previous ones left undecided.
+class EvaluatorPipeline:
+    def __init__(self, evaluators: list):
+        self.evaluators = evaluators
+
+    def evaluate(self, rows: list) -> list:
+        # Returns (is_correct, reason, evaluator name) per row, or None for rows only the LLM judge can decide.
+        verdicts = [None] * len(rows)
+        undecided = list(range(len(rows)))
+        for evaluator in self.evaluators:
+            if not undecided:
+                break
+            results = evaluator.evaluate([rows[i] for i in undecided])
+            still_undecided = []
+            for i, result in zip(undecided, results):
+                if result is None:
+                    still_undecided.append(i)
+                else:
+                    verdicts[i] = (result[0], result[1], evaluator.name)
+            undecided = still_undecided
+        return verdicts
+
+
+NUMBER_WORDS = {"one": 1, "two": 2, "three": 3, "four": 4, "five": 5, "ten": 10, "twenty": 20, "fifty": 50, "hundred": 100}
+_NUMBER = r"(\d+|" + "|".join(NUMBER_WORDS) + r")"
+_UNIT = r"(characters?|chars?|letters?|words?)"
+# (pattern, builder) for the instruction phrases that can be checked without a model
+INSTRUCTION_PATTERNS = [
+    (rf"(?:less|fewer|shorter) than {_NUMBER} {_UNIT}", lambda n, unit: LengthCheck(max_length=n - 1, unit=unit)),
+    (rf"(?:at most|no more than|up to|maximum(?: of)?|max(?:imum)?|under|within|not exceed(?:ing)?) {_NUMBER} {_UNIT}", lambda n, unit: LengthCheck(max_length=n, unit=unit)),
+    (rf"(?:more|longer) than {_NUMBER} {_UNIT}", lambda n, unit: LengthCheck(min_length=n + 1, unit=unit)),
+    (rf"(?:at least|no less than|no fewer than|minimum(?: of)?) {_NUMBER} {_UNIT}", lambda n, unit: LengthCheck(min_length=n, unit=unit)),
+    (r"\b(?:be |is |in )?(?:valid )?json\b(?: format)?", lambda: JSONCheck()),
+    (r"(?:not|never) (?:contain|include|mention)s? ['\"](.+?)['\"]", lambda text: RegexCheck(re.escape(text), must_match=False)),
+    (r"(?:contain|include|mention)s? ['\"](.+?)['\"]", lambda text: RegexCheck(re.escape(text))),
+    (r"match(?:es)? (?:the )?(?:regex|pattern) /(.+?)/", lambda pattern: RegexCheck(pattern)),
+]
+# Words that may surround the checkable phrases without adding a requirement of their own
+FILLER_WORDS = frozenset("""
+eval make sure ensure check that it its the output response respond answer reply is be should must has have and in of a an
+keep stay only with written as formatted format long length
+""".split())
+
+
+def parse_instruction(how_to_evaluate: str) -> tuple:
+    # Returns (checks, complete): the checks found in the instruction, and whether they cover all of it.
+    # Matched case-insensitively on the original text, so quoted strings and regexes keep their case
+    text = how_to_evaluate or ""
+    checks = []
+    for pattern, build in INSTRUCTION_PATTERNS:
+        for match in re.finditer(pattern, text, re.IGNORECASE):
+            arguments = [NUMBER_WORDS.get(group.lower(), group) for group in match.groups()]
+            arguments = [int(argument) if isinstance(argument, str) and argument.isdigit() else argument for argument in arguments]
+            if len(arguments) == 2:
+                arguments[1] = "words" if arguments[1].lower().startswith("word") else "characters"
+            checks.append(build(*arguments))
+        text = re.sub(pattern, " ", text, flags=re.IGNORECASE)
+    leftover = [word for word in re.findall(r"[\w']+", text.casefold()) if word not in FILLER_WORDS]
+    return checks, bool(checks) and not leftover
+
+
+# Default pipeline for an evaluation: the structural checks parsed from how_to_evaluate when they cover all of it, or,
+# when comparing against the ground truth (no how_to_evaluate), exact match. Word-overlap similarity ignores word order
+# ("Bob paid Alice" vs "Alice paid Bob"), so LexicalSimilarity is only used when passed in explicitly.
+def pipeline_for(how_to_evaluate: str = None) -> EvaluatorPipeline:
+    if not how_to_evaluate:
+        return EvaluatorPipeline([ExactMatch()])
+    checks, complete = parse_instruction(how_to_evaluate)
+    if not complete:
+        return EvaluatorPipeline([])
+    check = checks[0] if len(checks) == 1 else AllChecks(checks)
+    check.complete = True
+    return EvaluatorPipeline([check])
@@ -1,12 +1,10 @@
-import google.generativeai as genai
-from google.generativeai.types import HarmCategory, HarmBlockThreshold
 import os
-from dotenv import load_dotenv
 
 import sys
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from library import LLMLogger
 from backend.app import app
+from providers import get_provider
 
 
 from prompt_config import Config
@@ -30,38 +28,38 @@ Support requests for urgent issues (as defined in Understanding Case Priority an
 Targets) can be submitted at any time via our support portal or via email to urgent@marklogic.com.
 """
 
-SAFETY_SETTINGS =  {
-        HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
-        HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
-}
-
-load_dotenv()
-
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+# CHATBOT_PROVIDER=mock runs the agent offline (e.g. to benchmark it with load_test.py).
+PROVIDER = os.environ.get("CHATBOT_PROVIDER", "gemini")
+chat_model = get_provider(PROVIDER, "gemini-1.5-flash-8b")
+# Identifies the model behind answer_user_question for the logger's output cache
+CACHE_NAMESPACE = f"{PROVIDER}:{chat_model.model}:{chat_model.temperature}"
 
-dumbest_gemini_model = genai.GenerativeModel("gemini-1.5-flash-8b")
-gemini_flash = genai.GenerativeModel("gemini-1.5-flash")
 
 
-
-def construct_customer_support_prompt(user_message: str) -> str:
-    # Save prompt to logger here
-    agent_name = "customer_support"
-    prompt_to_return = logger.fill_template(Config[agent_name],
+def construct_customer_support_prompt(user_message: str, template: str) -> str:
+    prompt_to_return = logger.fill_template(template,
                                             user_message=user_message,
                                             EXAMPLE_CUSTOMER_SUPPORT_DOC=EXAMPLE_CUSTOMER_SUPPORT_DOC)
     return prompt_to_return
 
 
-def answer_user_question(inputs: str) -> str:
-    prompt = construct_customer_support_prompt(inputs)
-    logger.save_input(inputs = inputs, agent_name = "customer_support", prompt = Config["customer_support"])
-    response = dumbest_gemini_model.generate_content(prompt, safety_settings=SAFETY_SETTINGS)
-    logger.save_output(response.text, True, "customer_support")
+# prompt is the template to answer with; when it is not given, the current one from Config is used.
+def answer_user_question(inputs: str, prompt: str = None) -> str:
+    template = prompt if prompt is not None else Config["customer_support"]
+    filled_prompt = construct_customer_support_prompt(inputs, template)
+    test_case_id = logger.save_input(inputs = inputs, agent_name = "customer_support", prompt = template)
+    response = chat_model.generate(filled_prompt)
+    logger.save_output(response.text, True, "customer_support", prompt_tokens=response.prompt_tokens, completion_tokens=response.completion_tokens, test_case_id=test_case_id)
     return response.text
 
+
+# Streaming variant of answer_user_question: yields the answer as the model produces it, and logs it with its time to first token.
+def stream_user_question_answer(inputs: str, prompt: str = None):
+    template = prompt if prompt is not None else Config["customer_support"]
+    filled_prompt = construct_customer_support_prompt(inputs, template)
+    test_case_id = logger.save_input(inputs = inputs, agent_name = "customer_support", prompt = template)
+    yield from logger.stream_output(chat_model.stream(filled_prompt), True, "customer_support", test_case_id=test_case_id)
+
 if __name__ == "__main__":
     logger.start_process_here()
 
@@ -74,5 +72,6 @@ if __name__ == "__main__":
         You are a very rude customer support assistant with tweet length response that responds based on the customer support documentation: {{EXAMPLE_CUSTOMER_SUPPORT_DOC}}. 
         Your response should be empathetic and assuring that the team is taking the matter very seriously. 
         Respond politely to the user's message: {{user_message}}."""
-    reliability_score = logger.evaluate_complete_unit_test(answer_user_question, prompt = prompt, who_to_evaluate="customer_support", how_to_evaluate="Is the output polite?")
-    print(reliability_score)
\ No newline at end of file
+    reliability_score = logger.evaluate_complete_unit_test(answer_user_question, prompt = prompt, who_to_evaluate="customer_support", how_to_evaluate="Is the output polite?", cache_namespace=CACHE_NAMESPACE)
+    print(reliability_score)
+    logger.end_process_here()
\ No newline at end of file
@@ -1,4 +1,4 @@
-import React, { useState } from "react";
+import React, { useState, useEffect } from "react";
 import { Button, Modal, Box, TextareaAutosize } from "@mui/material";
 
 interface HeaderProps {
@@ -9,6 +9,16 @@ interface HeaderProps {
   correctPercentage: number | null;
 }
 
+interface PromptMetrics {
+  timed_cases: number;
+  avg_latency_ms: number | null;
+  p50_latency_ms: number | null;
+  p90_latency_ms: number | null;
+  avg_completion_tokens: number | null;
+  streamed_cases: number;
+  p50_ttft_ms: number | null;
+}
+
 const Header: React.FC<HeaderProps> = ({
   promptId,
   promptName,
@@ -18,6 +28,24 @@ const Header: React.FC<HeaderProps> = ({
 }) => {
   const [isModalOpen, setIsModalOpen] = useState(false);
   const [improvedPrompt, setImprovedPrompt] = useState("");
+  const [metrics, setMetrics] = useState<PromptMetrics | null>(null);
+  const [isImproving, setIsImproving] = useState(false);
+
+  useEffect(() => {
+    const fetchMetrics = async () => {
+      try {
+        const response = await fetch(
+          `http://localhost:9000/prompts/${promptId}/metrics`
+        );
+        setMetrics(await response.json());
+      } catch (error) {
+        console.error("Failed to fetch prompt metrics:", error);
+      }
+    };
+
+    setMetrics(null);
+    fetchMetrics();
+  }, [promptId]);
 
   const getSuccessRateColor = (percentage: number): string => {
     if (percentage >= 90) return "text-green-400";
@@ -25,19 +53,40 @@ const Header: React.FC<HeaderProps> = ({
     return "text-red-400";
   };
 
+  // Improvement runs as a background job; follow its status over server-sent events.
   const handleImprovePrompt = async () => {
     try {
+      setIsImproving(true);
       const response = await fetch(
         `http://localhost:9000/prompts/${promptId}/improve`,
         {
-          method: "GET",
+          method: "POST",
         }
       );
-      const data = await response.json();
-      setImprovedPrompt(data.improved_prompt);
-      setIsModalOpen(true);
+      const job = await response.json();
+      const events = new EventSource(
+        `http://localhost:9000/jobs/${job.job_id}/events`
+      );
+      events.addEventListener("status", (event) => {
+        const data = JSON.parse((event as MessageEvent).data);
+        if (data.status === "done") {
+          setImprovedPrompt(data.result.improved_prompt);
+          setIsModalOpen(true);
+        } else if (data.status === "failed") {
+          console.error("Failed to improve prompt:", data.error);
+        }
+        if (data.status === "done" || data.status === "failed") {
+          events.close();
+          setIsImproving(false);
+        }
+      });
+      events.onerror = () => {
+        events.close();
+        setIsImproving(false);
+      };
     } catch (error) {
       console.error("Failed to improve prompt:", error);
+      setIsImproving(false);
     }
   };
 
@@ -56,14 +105,25 @@ const Header: React.FC<HeaderProps> = ({
               Success Rate: {correctPercentage}%
             </p>
           )}
+          {metrics && metrics.timed_cases > 0 && (
+            <p className="text-lg mb-2 text-gray-300">
+              Latency: p50 {Math.round(metrics.p50_latency_ms ?? 0)} ms · p90{" "}
+              {Math.round(metrics.p90_latency_ms ?? 0)} ms
+              {metrics.streamed_cases > 0 &&
+                ` · first token p50 ${Math.round(metrics.p50_ttft_ms ?? 0)} ms`}
+              {metrics.avg_completion_tokens !== null &&
+                ` · ${Math.round(metrics.avg_completion_tokens)} output tokens avg`}
+            </p>
+          )}
         </div>
         <Button
           variant="contained"
           color="primary"
           onClick={handleImprovePrompt}
+          disabled={isImproving}
           className="bg-teal-500 hover:bg-teal-600 text-white"
         >
-          Improve Prompt
+          {isImproving ? "Improving..." : "Improve Prompt"}
         </Button>
       </div>
       <div className="w-full bg-gray-700 p-4 rounded-lg">
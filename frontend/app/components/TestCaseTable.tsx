@@ -23,23 +23,34 @@ export interface TestCase {
   how_to_evaluate: string;
 }
 
+const PAGE_SIZE = 100;
+
 const TestCaseTable: React.FC<{
   promptId: number;
   updateCorrectPercentage: (percentage: number) => void;
 }> = ({ promptId, updateCorrectPercentage }) => {
   const [rowData, setRowData] = useState<TestCase[]>([]);
+  const [nextCursor, setNextCursor] = useState<number | null>(null);
   const [selectedTestCase, setSelectedTestCase] = useState<TestCase | null>(
     null
   );
   const [isDrawerOpen, setIsDrawerOpen] = useState(false);
 
-  const fetchTestCases = async () => {
+  // The API is keyset-paginated: pass the last cursor to append the next page.
+  const fetchTestCases = async (afterId: number | null = null) => {
     try {
+      const params = new URLSearchParams({ limit: String(PAGE_SIZE) });
+      if (afterId !== null) {
+        params.set("after_id", String(afterId));
+      }
       const response = await fetch(
-        `http://localhost:9000/prompts/${promptId}/testcases`
+        `http://localhost:9000/prompts/${promptId}/testcases?${params}`
       );
       const data = await response.json();
-      setRowData(data.test_cases);
+      setRowData((rows) =>
+        afterId === null ? data.test_cases : [...rows, ...data.test_cases]
+      );
+      setNextCursor(data.next_cursor);
       updateCorrectPercentage(data.percent_correct);
     } catch (error) {
       console.error("Failed to fetch test cases:", error);
@@ -164,6 +175,17 @@ const TestCaseTable: React.FC<{
           ))}
         </tbody>
       </table>
+      {nextCursor !== null && (
+        <div className="p-4 text-center">
+          <Button
+            variant="outlined"
+            onClick={() => fetchTestCases(nextCursor)}
+            className="text-teal-400 border-teal-400"
+          >
+            Load more
+          </Button>
+        </div>
+      )}
 
       <Drawer
         anchor="right"
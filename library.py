@@ -1,4 +1,131 @@
-from backend.app import db, TestCase, EvaluateOrNot, Prompt
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+import inspect
+import itertools
+import json
+import random
+import threading
+import time
+
+from sqlalchemy import and_, case, func, insert, or_
+
+from backend.app import db, TestCase, EvaluateOrNot, EvaluationRun, Prompt, Run
+from backend.migrations import hash_prompt
+from evaluators import pipeline_for
+from prompt_templates import compile_template
+from providers import LangChainProvider, get_provider, is_stream
+from rate_limiter import RateLimiter
+from write_behind import WriteBehindQueue
+
+
+QUERY_LLM_TEMPLATE = """
+        Question: {prompt}
+        
+        Input: {input}
+        Output: {output}
+        
+        Please answer the question and provide a reason if the answer is no.
+        
+        Respond only with a JSON object of the form {{"is_correct": true or false, "reason": "..."}}.
+        """
+
+DEFAULT_EVALUATION_LABEL = "Compare the ground truth, new outputs for semantic equivalence."
+
+EQUIVALENCE_TEMPLATE = "Compare these two outputs and determine if they are semantically equivalent:\n\nOriginal: {original_output}\n\nNew: {new_output}\n\nAre they equivalent? Answer with 'Yes' or 'No' and provide a brief explanation."
+
+CUSTOM_EVALUATION_SUFFIX = "\n\nHere are the original and new outputs:\n\nOriginal: {original_output}\n\nNew: {new_output} Answer the question with 'Yes' or 'No' and provide a brief explanation."
+
+
+# The response model is only built once, the first time the judge needs it.
+@lru_cache(maxsize=None)
+def get_query_response_model():
+    from pydantic import BaseModel, Field
+
+    class QueryResponse(BaseModel):
+        is_correct: bool = Field(description="Whether the answer is yes or no to the question")
+        reason: str = Field("", description="The reason for the answer, especially if it's no")
+
+    return QueryResponse
+
+
+def parse_query_response(text: str):
+    # The judge is asked for bare JSON, but tolerate prose or code fences around it.
+    start, end = text.find("{"), text.rfind("}")
+    return get_query_response_model().model_validate_json(text[start:end + 1] if start != -1 else text)
+
+
+def render_evaluation_prompt(how_to_evaluate: str, original_output: str, new_output: str) -> str:
+    if not how_to_evaluate:
+        return EQUIVALENCE_TEMPLATE.format(original_output=original_output, new_output=new_output)
+    # how_to_evaluate is user text, so it is never passed through str.format itself.
+    return how_to_evaluate + CUSTOM_EVALUATION_SUFFIX.format(original_output=original_output, new_output=new_output)
+
+
+def accepts_prompt(function) -> bool:
+    # Whether a running function can be given the prompt to use explicitly, as running_function(inputs=..., prompt=...).
+    try:
+        parameters = inspect.signature(function).parameters
+    except (TypeError, ValueError):
+        return False
+    return "prompt" in parameters or any(parameter.kind is inspect.Parameter.VAR_KEYWORD for parameter in parameters.values())
+
+
+def format_prompt_comparison(rows: list) -> str:
+    def format_number(value, suffix=""):
+        return f"{value:.1f}{suffix}" if value is not None else "-"
+
+    header = f"{'prompt_id':>9} {'reliability':>11} {'cases':>7} {'p50 ms':>9} {'p90 ms':>9} {'tokens':>8}  prompt"
+    lines = [header, "-" * len(header)]
+    for row in rows:
+        prompt_preview = " ".join((row["prompt"] or "").split())[:60]
+        lines.append(
+            f"{row['prompt_id']:>9} {format_number(row['reliability'], '%'):>11} {row['test_cases']:>7} "
+            f"{format_number(row['p50_ms']):>9} {format_number(row['p90_ms']):>9} {format_number(row['mean_tokens']):>8}  {prompt_preview}"
+        )
+    return "\n".join(lines)
+
+
+def chunk_text(chunk) -> str:
+    # Text of a streamed chunk: a plain string (providers' stream), a Gemini response chunk or an OpenAI completion chunk.
+    if isinstance(chunk, str):
+        return chunk
+    if getattr(chunk, "choices", None) is not None:
+        return (chunk.choices[0].delta.content or "") if chunk.choices else ""
+    return chunk.text if getattr(chunk, "parts", True) else ""
+
+
+def chunk_usage(chunk):
+    # (prompt_tokens, completion_tokens) reported on a streamed chunk, or None. Streams report usage on their last chunks.
+    usage = getattr(chunk, "usage_metadata", None)
+    if usage is not None and getattr(usage, "prompt_token_count", None):
+        return usage.prompt_token_count, usage.candidates_token_count
+    usage = getattr(chunk, "usage", None)
+    if usage is not None and getattr(usage, "prompt_tokens", None):
+        return usage.prompt_tokens, usage.completion_tokens
+    return None
+
+
+def stream_metrics(started_at: float, chunk_times: list) -> dict:
+    # Streaming columns of a test case from perf_counter times: when the call started and when each chunk arrived.
+    # Tokens are counted as the chunks the stream yields, so the inter-token gaps are the gaps between chunks.
+    gaps = [(later - earlier) * 1000 for earlier, later in zip(chunk_times, chunk_times[1:])]
+    return {
+        "ttft_ms": (chunk_times[0] - started_at) * 1000 if chunk_times else None,
+        "mean_inter_token_ms": sum(gaps) / len(gaps) if gaps else None,
+        "max_inter_token_ms": max(gaps) if gaps else None,
+    }
+
+
+def cache_identity(function):
+    # module.qualname of a running function, or None when that name is not unique and stable across runs
+    # (lambdas, functions defined inside other functions, partials), so its outputs cannot be cached safely.
+    qualname = getattr(function, "__qualname__", None)
+    module = getattr(function, "__module__", None)
+    if not qualname or not module or "<lambda>" in qualname or "<locals>" in qualname:
+        return None
+    return f"{module}.{qualname}"
 
 
 # Create a sample element in EvaluateOrNot that has is_evaluate = False
@@ -8,109 +135,276 @@ def create_sample_evaluate_or_not():
     db.session.commit()
 
 class LLMLogger:
-    def __init__(self, app):
+    # judge_provider / generation_provider are providers.Provider instances for the LLM judge and for synthesizing test cases;
+    # both default to OpenAI gpt-3.5-turbo. judge_llm is still accepted and wraps a langchain LLM / chat model as the judge.
+    # cache is an optional llm_cache.LLMCache; when set, judge verdicts are reused across runs, and so are regenerated outputs
+    # of module-level running functions called with a cache_namespace.
+    # write_behind=True makes save_input/save_output enqueue records for a background writer instead of writing inline;
+    # see write_behind.WriteBehindQueue for the queue size, batch size and backpressure options.
+    def __init__(self, app, judge_provider=None, generation_provider=None, judge_llm=None, cache=None, write_behind: bool = False, max_queue_size: int = 10000, write_batch_size: int = 500, backpressure: str = "block"):
         self.process_id = 0
         self.app = app
         self.is_evaluate, self.evaluation_id = self.get_evaluate()
-        self.do_db_actions = True
+        # do_db_actions is tracked per thread so concurrent workers can suppress logging independently.
+        self._local = threading.local()
+        # Providers are created once and reused, so their HTTP connection pool and rate limit are shared across calls.
+        self._judge_provider = judge_provider if judge_provider is not None else LangChainProvider(judge_llm) if judge_llm is not None else None
+        self._generation_provider = generation_provider
+        self.cache = cache
+        self.writer = WriteBehindQueue(self.write_records, max_queue_size=max_queue_size, batch_size=write_batch_size, backpressure=backpressure) if write_behind else None
+        # With write-behind, save_input returns a negative ticket instead of the not-yet-written row id.
+        # Tickets whose input has been written but whose output has not are resolved through _ticket_ids.
+        self._tickets = itertools.count(1)
+        self._ticket_ids = {}
+
+    @property
+    def do_db_actions(self):
+        return getattr(self._local, "do_db_actions", True)
+
+    @do_db_actions.setter
+    def do_db_actions(self, value):
+        self._local.do_db_actions = value
+
+    @contextmanager
+    def suppress_db_actions(self):
+        # Turns off logging for the current thread only, restoring the previous value afterwards.
+        previous = self.do_db_actions
+        self.do_db_actions = False
+        try:
+            yield
+        finally:
+            self.do_db_actions = previous
 
     def get_evaluate(self):
         with self.app.app_context():
             evaluate = EvaluateOrNot.query.first()
             return evaluate.is_evaluate, evaluate.id
 
-    def start_process_here(self):
+    # Allocates a new process_id by inserting a run, so concurrent workers can never get the same one.
+    # metadata is any JSON-serializable description of the run (host, git sha, config...).
+    def start_process_here(self, metadata: dict = None) -> int:
+        self.flush()
         with self.app.app_context():
-            last_entry = TestCase.query.order_by(TestCase.process_id.desc()).first()
-            if last_entry:
-                self.process_id = last_entry.process_id + 1
-            else:
-                self.process_id = 1
+            run = Run(started_at=datetime.utcnow(), run_metadata=json.dumps(metadata) if metadata is not None else None)
+            db.session.add(run)
+            db.session.commit()
+            self.process_id = run.id
+        return self.process_id
 
-    def query_llm(self, prompt: str, input: str = None, output: str = None) -> tuple:
-        from langchain.llms import OpenAI
-        from langchain.prompts import PromptTemplate
-        from langchain.chains import LLMChain
-        from langchain.output_parsers import PydanticOutputParser
-        from pydantic import BaseModel, Field
+    def end_process_here(self):
+        self.flush()
+        with self.app.app_context():
+            run = db.session.get(Run, self.process_id)
+            if run is not None:
+                run.ended_at = datetime.utcnow()
+                db.session.commit()
 
-        class QueryResponse(BaseModel):
-            is_correct: bool = Field(description="Whether the answer is yes or no to the question")
-            reason: str = Field(description="The reason for the answer, especially if it's no")
+    @property
+    def judge_provider(self):
+        if self._judge_provider is None:
+            self._judge_provider = get_provider("openai", "gpt-3.5-turbo")
+        return self._judge_provider
 
-        llm = OpenAI(temperature=0)
-        output_parser = PydanticOutputParser(pydantic_object=QueryResponse)
+    @property
+    def generation_provider(self):
+        if self._generation_provider is None:
+            self._generation_provider = get_provider("openai", "gpt-3.5-turbo")
+        return self._generation_provider
 
-        template = """
-        Question: {prompt}
-        
-        Input: {input}
-        Output: {output}
-        
-        Please answer the question and provide a reason if the answer is no.
-        
-        {format_instructions}
-        """
+    def set_judge_provider(self, judge_provider):
+        self._judge_provider = judge_provider
 
-        prompt_template = PromptTemplate(
-            input_variables=["prompt", "input", "output"],
-            template=template,
-            partial_variables={"format_instructions": output_parser.get_format_instructions()}
-        )
+    def set_judge_llm(self, judge_llm):
+        # Swap in a langchain LLM / chat model as the judge.
+        self._judge_provider = LangChainProvider(judge_llm)
+
+    # Sends a rendered prompt to the judge, going through the cache when one is configured.
+    # limiter is an extra caller-side rate limit, only spent on calls that actually reach the provider.
+    def judge(self, prompt_text: str, limiter: RateLimiter = None) -> str:
+        provider = self.judge_provider
+
+        def call_provider():
+            if limiter is not None:
+                limiter.acquire()
+            return provider.generate(prompt_text).text
 
-        chain = LLMChain(llm=llm, prompt=prompt_template)
+        if self.cache is None:
+            return call_provider()
+        key = self.cache.make_key(provider.model, prompt_text, None, None, provider.temperature)
+        return self.cache.get_or_compute(key, call_provider)
 
-        result = chain.run(prompt=prompt, input=input, output=output)
-        parsed_result = output_parser.parse(result)
+    def query_llm(self, prompt: str, input: str = None, output: str = None) -> tuple:
+        result = self.judge(QUERY_LLM_TEMPLATE.format(prompt=prompt, input=input, output=output))
+        parsed_result = parse_query_response(result)
 
         return parsed_result.is_correct, parsed_result.reason if not parsed_result.is_correct else None
 
+    # Returns the id of the logged test case (a negative ticket with write-behind), to pass to save_output as test_case_id.
     def save_input(self, inputs: str, agent_name: str, prompt: str):
-        
         if not self.do_db_actions:
+            self.start_call_timer(agent_name)
             return None
-        with self.app.app_context():
-            prompt_id = self.save_prompt_to_table(prompt = prompt, agent_name = agent_name, model_name = "gemini-1.5-flash")
-            new_entry = TestCase(process_id=self.process_id, input=inputs, agent_name=agent_name, prompt_id = prompt_id)
-            db.session.add(new_entry)
-            db.session.commit()
-            return None
+        if self.writer is not None:
+            test_case_id = -next(self._tickets)
+            self.writer.put(("input", test_case_id, self.process_id, inputs, agent_name, prompt, datetime.utcnow()))
+        else:
+            test_case_id = self.write_records([("input", None, self.process_id, inputs, agent_name, prompt, datetime.utcnow())])[0]
+        # Remember when this agent's call started, and which row it is, on this thread for the matching save_output.
+        # The timer starts after the input is written, so latency_ms does not include the logger's own database write.
+        self.start_call_timer(agent_name)
+        self.last_test_case_ids()[agent_name] = test_case_id
+        return test_case_id
 
-    def save_output(self, content: str, is_correct: bool, agent_name: str, reason_failure: str = None):
+    # prompt_tokens / completion_tokens are optional usage counts from the model response.
+    # test_case_id is what save_input returned; without it, the last save_input for agent_name on this thread is used.
+    # ttft_ms / mean_inter_token_ms / max_inter_token_ms are the streaming metrics, filled in by stream_output.
+    def save_output(self, content: str, is_correct: bool, agent_name: str, reason_failure: str = None, prompt_tokens: int = None, completion_tokens: int = None, test_case_id: int = None,
+                    ttft_ms: float = None, mean_inter_token_ms: float = None, max_inter_token_ms: float = None):
+        call_started_at, started_at = self.call_started_at().pop(agent_name, (None, None))
         if not self.do_db_actions:
+            # Still hand the call's metrics to whoever suppressed logging (e.g. the regeneration path) on this thread.
+            self._local.last_call_metrics = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "ttft_ms": ttft_ms,
+                                             "mean_inter_token_ms": mean_inter_token_ms, "max_inter_token_ms": max_inter_token_ms}
+            return None
+        latency_ms = (time.perf_counter() - call_started_at) * 1000 if call_started_at is not None else None
+        if test_case_id is None:
+            test_case_id = self.last_test_case_ids().pop(agent_name, None)
+        record = ("output", test_case_id, self.process_id, content, is_correct, agent_name, reason_failure, datetime.utcnow(), latency_ms, prompt_tokens, completion_tokens,
+                  ttft_ms, mean_inter_token_ms, max_inter_token_ms, started_at)
+        if self.writer is not None:
+            self.writer.put(record)
             return None
+        self.write_records([record])
+
+    # Streaming counterpart of save_output: wraps the chunks of a streamed response (e.g. provider.stream(...) or a
+    # generate_content(..., stream=True) response) and yields them on unchanged as they arrive. When the stream ends, the
+    # assembled text is saved through save_output with its time to first token, inter-token gaps, total duration and the
+    # usage reported by the stream. Timing starts at the agent's save_input, or when the stream is first read without one.
+    # A stream that fails or is abandoned before its end is not saved.
+    def stream_output(self, chunks, is_correct: bool, agent_name: str, reason_failure: str = None, test_case_id: int = None):
+        started_at = self.call_started_at().setdefault(agent_name, (time.perf_counter(), datetime.utcnow()))[0]
+        parts, chunk_times, usage = [], [], (None, None)
+        for chunk in chunks:
+            chunk_times.append(time.perf_counter())
+            parts.append(chunk_text(chunk))
+            usage = chunk_usage(chunk) or usage
+            yield chunk
+        self.save_output("".join(parts), is_correct, agent_name, reason_failure, *usage, test_case_id=test_case_id, **stream_metrics(started_at, chunk_times))
+
+    # (perf_counter, utcnow) of the call each agent is making on this thread
+    def call_started_at(self) -> dict:
+        if not hasattr(self._local, "call_started_at"):
+            self._local.call_started_at = {}
+        return self._local.call_started_at
+
+    def start_call_timer(self, agent_name: str):
+        self.call_started_at()[agent_name] = (time.perf_counter(), datetime.utcnow())
+
+    def last_test_case_ids(self) -> dict:
+        if not hasattr(self._local, "last_test_case_ids"):
+            self._local.last_test_case_ids = {}
+        return self._local.last_test_case_ids
+
+    # Applies queued save_input/save_output records in order, in a single transaction.
+    # Returns the ids of the test cases created by the input records.
+    def write_records(self, records) -> list:
         with self.app.app_context():
-            entry = TestCase.query.filter_by(process_id=self.process_id, agent_name=agent_name).first()
+            # Inputs of this batch by ticket, so outputs in the same batch find their row before it has an id.
+            pending = {}
+            new_entries = []
+            for kind, test_case_id, *args in records:
+                if kind == "input":
+                    entry = self.write_input(*args)
+                    new_entries.append(entry)
+                    if test_case_id is not None:
+                        pending[test_case_id] = entry
+                else:
+                    entry = pending.pop(test_case_id, None) or self.find_logged_test_case(test_case_id, args[0], args[3])
+                    if entry is None and test_case_id is not None:
+                        print(f"No input found for test case {test_case_id} of agent_name {args[3]}; its output was not saved")
+                        continue
+                    self.write_output(entry, *args)
+            db.session.flush()
+            for ticket, entry in pending.items():
+                self._ticket_ids[ticket] = entry.id
+            test_case_ids = [entry.id for entry in new_entries]
+            db.session.commit()
+            return test_case_ids
+
+    # Row of a save_input: by id, by write-behind ticket, or for callers without either, the latest unanswered row of the agent.
+    # A ticket whose input was never written gives None; guessing the row would attach the output to another call.
+    def find_logged_test_case(self, test_case_id: int, process_id: int, agent_name: str):
+        if test_case_id is not None and test_case_id < 0:
+            test_case_id = self._ticket_ids.pop(test_case_id, None)
+            if test_case_id is None:
+                return None
+        if test_case_id is not None:
+            return db.session.get(TestCase, test_case_id)
+        return (
+            TestCase.query.filter_by(process_id=process_id, agent_name=agent_name)
+            .filter(TestCase.output.is_(None))
+            .order_by(TestCase.id.desc())
+            .first()
+        )
+
+    def write_input(self, process_id: int, inputs: str, agent_name: str, prompt: str, started_at: datetime = None):
+        prompt_id = self.get_or_add_prompt(prompt = prompt, agent_name = agent_name, model_name = "gemini-1.5-flash", process_id = process_id)
+        new_entry = TestCase(process_id=process_id, input=inputs, agent_name=agent_name, prompt_id = prompt_id, started_at=started_at)
+        db.session.add(new_entry)
+        return new_entry
+
+    def write_output(self, entry, process_id: int, content: str, is_correct: bool, agent_name: str, reason_failure: str = None, finished_at: datetime = None, latency_ms: float = None, prompt_tokens: int = None, completion_tokens: int = None,
+                     ttft_ms: float = None, mean_inter_token_ms: float = None, max_inter_token_ms: float = None, started_at: datetime = None):
+        if entry:
+            if started_at is not None:
+                # When the timer started, right after the input was written; latency_ms is measured from here
+                entry.started_at = started_at
+            entry.output = content
+            entry.is_correct = is_correct
+            entry.finished_at = finished_at
+            entry.latency_ms = latency_ms
+            entry.prompt_tokens = prompt_tokens
+            entry.completion_tokens = completion_tokens
+            entry.ttft_ms = ttft_ms
+            entry.mean_inter_token_ms = mean_inter_token_ms
+            entry.max_inter_token_ms = max_inter_token_ms
             
-            if entry:
-                entry.output = content
-                entry.is_correct = is_correct
-                
-                if not is_correct:
-                    print("Input:")
-                    print(entry.input)
-                    print("\nOutput:")
-                    print(content)
-                    reason = reason_failure if reason_failure else "Did not provide a reason"#input("\nWhy is this output incorrect? ")
-                    entry.reason = reason
-                    print(f"Execution paused. Reason for incorrectness: {reason}")
-                db.session.commit()
-            else:
-                print(f"No input found for run number {self.process_id} and agent_name {agent_name}")
+            if not is_correct:
+                print("Input:")
+                print(entry.input)
+                print("\nOutput:")
+                print(content)
+                reason = reason_failure if reason_failure else "Did not provide a reason"#input("\nWhy is this output incorrect? ")
+                entry.reason = reason
+                print(f"Execution paused. Reason for incorrectness: {reason}")
+        else:
+            print(f"No input found for run number {process_id} and agent_name {agent_name}")
+
+    # Waits until every queued write-behind record is in the database. No-op when writing inline.
+    def flush(self):
+        if self.writer is not None:
+            self.writer.flush()
 
     # This auto-assigns if a query is correct or not based on the LLM's judgement.
-    def save_output_using_llm(self, content: str, is_correct_query: str, agent_name: str):
+    def save_output_using_llm(self, content: str, is_correct_query: str, agent_name: str, test_case_id: int = None):
         if not self.do_db_actions:
             return None
+        self.flush()
+        if test_case_id is None:
+            test_case_id = self.last_test_case_ids().pop(agent_name, None)
         with self.app.app_context():
-            entry = TestCase.query.filter_by(process_id=self.process_id, agent_name=agent_name).first()
+            entry = self.find_logged_test_case(test_case_id, self.process_id, agent_name)
             
             if entry:
                 entry.output = content
                 
-                # Use the is_correct_query to determine correctness
-                # This assumes you have a method to query an LLM
-                is_correct = self.query_llm(is_correct_query, entry.input, content)
+                # Use the is_correct_query to determine correctness: checks it spells out (length, JSON, ...) are decided
+                # locally, anything else by the judge, which returns the reason in the same call
+                verdict = pipeline_for(is_correct_query).evaluate([{"input": entry.input, "output": content, "ground_truth": entry.ground_truth}])[0]
+                if verdict is not None:
+                    is_correct, reason, _ = verdict
+                else:
+                    is_correct, reason = self.query_llm(is_correct_query, entry.input, content)
                 entry.is_correct = is_correct
                 
                 if not is_correct:
@@ -118,7 +412,6 @@ class LLMLogger:
                     print(entry.input)
                     print("\nOutput:")
                     print(content)
-                    reason = self.query_llm(f"Why is this output incorrect?\nInput: {entry.input}\nOutput: {content}")
                     entry.reason = reason
                     print(f"Execution paused. Reason for incorrectness: {reason}")
                 
@@ -129,133 +422,464 @@ class LLMLogger:
     def save_prompt_to_table(self, prompt, agent_name, model_name = None):
         if not self.do_db_actions:
             return None
-        # if exact same agent name and prompt already exists, return the id
         with self.app.app_context():
-            existing_prompt = Prompt.query.filter_by(agent_name=agent_name, prompt = prompt.strip()).first()
-            if existing_prompt:
-                return existing_prompt.id
+            prompt_id = self.get_or_add_prompt(prompt, agent_name, model_name, self.process_id)
+            db.session.commit()
+            return prompt_id
+
+    # Runs inside the caller's app context and session; the caller commits.
+    def get_or_add_prompt(self, prompt, agent_name, model_name, process_id):
+        # if exact same agent name and prompt already exists, return the id (matched on the indexed hash of the stripped prompt)
+        existing_prompt = Prompt.query.filter_by(agent_name=agent_name, prompt_hash=hash_prompt(prompt)).first()
+        if existing_prompt:
+            return existing_prompt.id
 
         # If agent_name exists in db already, find its model name
-        with self.app.app_context():
-            existing_entry = Prompt.query.filter_by(agent_name=agent_name).first()
-            if existing_entry:
-                model_name = existing_entry.model_name
-            existing_entry_complete = Prompt.query.filter_by(agent_name=agent_name, model_name=model_name, process_id=self.process_id, prompt = prompt.strip()).first()
-            if not existing_entry_complete:
-                new_entry = Prompt(prompt=prompt, agent_name=agent_name, model_name=model_name, process_id=self.process_id)
-                db.session.add(new_entry)
-                db.session.commit()
-            return new_entry.id
+        existing_entry = Prompt.query.filter_by(agent_name=agent_name).first()
+        if existing_entry:
+            model_name = existing_entry.model_name
+        new_entry = Prompt(prompt=prompt, agent_name=agent_name, model_name=model_name, process_id=process_id)
+        db.session.add(new_entry)
+        db.session.flush()
+        return new_entry.id
 
     # This is for when you want to generate new outputs for the current prompt in code and all inputs to the same agent_name previously.
-    def generate_new_prompt_outputs(self, running_function, prompt_id: int):
+    # max_concurrency > 1 fans the running_function calls out over a thread pool; rows are still written in input order.
+    # Runs running_function on every distinct stored input that has no output for prompt_id yet, so an interrupted run
+    # picks up where it stopped. Outputs are committed every chunk_size inputs.
+    # inputs optionally limits the run to those inputs.
+    # With a cache, outputs are only reused when cache_namespace is given: it must identify what the running function calls
+    # and how (e.g. "gemini:gemini-1.5-flash-8b:0.0"), since the function's name alone does not, and is part of the cache key.
+    def generate_new_prompt_outputs(self, running_function, prompt_id: int, max_concurrency: int = 1, agent_name: str = None, chunk_size: int = 100, inputs: list = None, cache_namespace: str = None):
+        return self.generate_prompt_matrix_outputs(running_function, [prompt_id], max_concurrency=max_concurrency, agent_name=agent_name, chunk_size=chunk_size, inputs=inputs, cache_namespace=cache_namespace)
+
+    # Same as generate_new_prompt_outputs for several prompts at once: every (prompt, input) pair without an output runs
+    # on one shared pool of max_concurrency workers. Running functions that take a `prompt` argument get the prompt text
+    # passed in; otherwise they read the prompt from prompt_config.Config themselves. Running functions may also return a
+    # stream of chunks (see stream_output); it is read to the end here and stored with its streaming metrics.
+    def generate_prompt_matrix_outputs(self, running_function, prompt_ids: list, max_concurrency: int = 1, agent_name: str = None, chunk_size: int = 100, inputs: list = None, cache_namespace: str = None):
         if not self.do_db_actions:
             return None
-        from langchain.chains.llm import LLMChain
-        from langchain_openai.chat_models import ChatOpenAI
-        from langchain.prompts import PromptTemplate
-        from langchain.chains import LLMChain
-        import json
 
+        pass_prompt = accepts_prompt(running_function)
         with self.app.app_context():
-            entries = TestCase.query.order_by(TestCase.process_id, TestCase.id).all()
-            # Get distinct inputs
-            distinct_inputs = set(entry.input for entry in entries if entry.input)
-            
-            for distinct_input in distinct_inputs:
-                # Find the first entry with this input
-                entry = next(e for e in entries if e.input == distinct_input)
-                
-                # Simulate input
+            prompt_texts = dict(db.session.query(Prompt.id, Prompt.prompt).filter(Prompt.id.in_(prompt_ids)).all())
+            tasks = [
+                (prompt_id, entry)
+                for prompt_id in prompt_ids
+                for entry in self.get_distinct_input_entries(agent_name, missing_output_for_prompt_id=prompt_id, inputs=inputs)
+            ]
+            function_name = cache_identity(running_function)
+            use_cache = self.cache is not None and cache_namespace is not None and function_name is not None
+            if self.cache is not None and not use_cache:
+                print("LLM cache: not reusing regenerated outputs; that needs a cache_namespace and a module-level running function")
+
+            def call_running_function(prompt_id, entry, metrics):
+                # The running function logs through this same logger, so keep it quiet for this worker only.
+                with self.suppress_db_actions():
+                    self._local.last_call_metrics = {}
+                    metrics["started_at"] = datetime.utcnow()
+                    call_started_at = time.perf_counter()
+                    if pass_prompt:
+                        output = running_function(inputs=entry.input, prompt=prompt_texts.get(prompt_id))
+                    else:
+                        output = running_function(inputs=entry.input)
+                    chunk_times = []
+                    if is_stream(output):
+                        parts = []
+                        for chunk in output:
+                            chunk_times.append(time.perf_counter())
+                            parts.append(chunk_text(chunk))
+                        output = "".join(parts)
+                    metrics["latency_ms"] = (time.perf_counter() - call_started_at) * 1000
+                    metrics["finished_at"] = datetime.utcnow()
+                    metrics.update(self._local.last_call_metrics)
+                    if chunk_times:
+                        metrics.update(stream_metrics(call_started_at, chunk_times))
+                return output
+
+            def run_one(task):
+                prompt_id, entry = task
                 print(f"Processing distinct input for system {entry.agent_name}")
-                # Here you would typically call the function that processes this input
-                self.do_db_actions = False
-                new_output = running_function(inputs=distinct_input)
-                self.do_db_actions = True
-                new_entry = TestCase(process_id=self.process_id, input=distinct_input, output=new_output, agent_name=entry.agent_name, prompt_id=prompt_id, ground_truth=entry.ground_truth if entry.ground_truth else None)
-                db.session.add(new_entry)
-            db.session.commit()
-            db.session.close()
+                # Cache hits make no call, so they carry no timing or token metrics.
+                metrics = {}
+                if not use_cache:
+                    return call_running_function(prompt_id, entry, metrics), metrics
+                key = self.cache.make_key(cache_namespace, prompt_texts.get(prompt_id), entry.input, function=function_name)
+                return self.cache.get_or_compute(key, lambda: call_running_function(prompt_id, entry, metrics)), metrics
+
+            with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                try:
+                    for chunk_start in range(0, len(tasks), chunk_size):
+                        chunk = tasks[chunk_start:chunk_start + chunk_size]
+                        results = list(executor.map(run_one, chunk)) if max_concurrency > 1 else [run_one(task) for task in chunk]
+
+                        for (prompt_id, entry), (new_output, metrics) in zip(chunk, results):
+                            new_entry = TestCase(process_id=self.process_id, input=entry.input, output=new_output, agent_name=entry.agent_name, prompt_id=prompt_id, ground_truth=entry.ground_truth if entry.ground_truth else None, **metrics)
+                            db.session.add(new_entry)
+                        db.session.commit()
+                finally:
+                    db.session.close()
+
+    # First row (by process_id, id) for every distinct non-empty input, computed in SQL so only the result is loaded.
+    # missing_output_for_prompt_id leaves out inputs that already have an output for that prompt.
+    def get_distinct_input_entries(self, agent_name: str = None, prompt_id: int = None, missing_output_for_prompt_id: int = None, inputs: list = None):
+        row_number = func.row_number().over(partition_by=TestCase.input, order_by=(TestCase.process_id, TestCase.id)).label("row_number")
+        first_rows = db.session.query(TestCase.id.label("id"), row_number).filter(TestCase.input.isnot(None), TestCase.input != "")
+        if agent_name:
+            first_rows = first_rows.filter(TestCase.agent_name == agent_name)
+        if prompt_id is not None:
+            first_rows = first_rows.filter(TestCase.prompt_id == prompt_id)
+        if missing_output_for_prompt_id is not None:
+            # NULL inputs are left out: a single NULL would make NOT IN never true and leave nothing to regenerate
+            answered_inputs = db.session.query(TestCase.input).filter(TestCase.prompt_id == missing_output_for_prompt_id, TestCase.output.isnot(None), TestCase.input.isnot(None))
+            if agent_name:
+                answered_inputs = answered_inputs.filter(TestCase.agent_name == agent_name)
+            first_rows = first_rows.filter(TestCase.input.notin_(answered_inputs))
+        if inputs is not None:
+            first_rows = first_rows.filter(TestCase.input.in_(inputs))
+        first_rows = first_rows.subquery()
+        return (
+            db.session.query(TestCase.id, TestCase.input, TestCase.agent_name, TestCase.prompt_id, TestCase.ground_truth)
+            .join(first_rows, TestCase.id == first_rows.c.id)
+            .filter(first_rows.c.row_number == 1)
+            .order_by(TestCase.process_id, TestCase.id)
+            .all()
+        )
+
+    # Starts an evaluation run, or loads run_id to resume it with its stored parameters.
+    def get_or_start_evaluation_run(self, run_id: int, prompt_id: int, agent_name: str, how_to_evaluate: str):
+        if run_id is not None:
+            run = db.session.get(EvaluationRun, run_id)
+            if run is None:
+                raise ValueError(f"Evaluation run {run_id} does not exist")
+            print(f"Resuming evaluation run {run.id} ({run.completed}/{run.total} judged)")
+        else:
+            run = EvaluationRun(prompt_id=prompt_id, agent_name=agent_name, how_to_evaluate=how_to_evaluate, completed=0, started_at=datetime.utcnow())
+            db.session.add(run)
+        run.status = "running"
+        run.error = None
+        run.updated_at = datetime.utcnow()
+        db.session.commit()
+        return run
 
     # Applies the evaluation metric to the latest prompt outputs.
-    def evaluate_latest_prompt_outputs(self, how_to_evaluate: str, who_to_evaluate: str, prompt_id: int):
+    # Judge calls run on max_concurrency threads under a shared rate limiter; verdicts are written with one bulk update per chunk.
+    # Rows that already have a verdict for this evaluation are skipped, and progress is saved with every chunk in an
+    # EvaluationRun, so rerunning (or passing run_id to resume a run) only judges what is left. Returns the run id.
+    # evaluators is an evaluators.EvaluatorPipeline run over each chunk first; only rows it leaves undecided reach the
+    # LLM judge. By default it is built from how_to_evaluate (see evaluators.pipeline_for). inputs optionally limits the
+    # evaluation to the test cases of those inputs.
+    def evaluate_latest_prompt_outputs(self, how_to_evaluate: str, who_to_evaluate: str, prompt_id: int, max_concurrency: int = 1, requests_per_minute: float = None, chunk_size: int = 100, run_id: int = None, evaluators=None, inputs: list = None):
         if not self.do_db_actions:
             return None
-        from langchain.chains.llm import LLMChain
-        from langchain_openai.chat_models import ChatOpenAI
-        from langchain.prompts import PromptTemplate
-        from langchain.chains import LLMChain
-
         with self.app.app_context():
-            entries = TestCase.query.order_by(TestCase.process_id, TestCase.id).all()
-            # Filter entries based on who_to_evaluate
-            entries = [entry for entry in entries if entry.agent_name == who_to_evaluate and entry.prompt_id == prompt_id]
+            run = self.get_or_start_evaluation_run(run_id, prompt_id, who_to_evaluate, how_to_evaluate)
+            run_id, how_to_evaluate, who_to_evaluate, prompt_id = run.id, run.how_to_evaluate, run.agent_name, run.prompt_id
+            evaluation_label = how_to_evaluate if how_to_evaluate else DEFAULT_EVALUATION_LABEL
+
+            # Filter entries based on who_to_evaluate. There should either be ground truth or a how_to_evaluate prompt
+            entries = (
+                db.session.query(TestCase.id, TestCase.process_id, TestCase.agent_name, TestCase.ground_truth, TestCase.output)
+                .filter(TestCase.agent_name == who_to_evaluate, TestCase.prompt_id == prompt_id)
+                .filter(TestCase.input.isnot(None), TestCase.input != "")
+            )
             if not how_to_evaluate:
-                llm = ChatOpenAI(temperature=0)
-                prompt_template = PromptTemplate(
-                    input_variables=["original_output", "new_output"],
-                    template="Compare these two outputs and determine if they are semantically equivalent:\n\nOriginal: {original_output}\n\nNew: {new_output}\n\nAre they equivalent? Answer with 'Yes' or 'No' and provide a brief explanation."
-                )
-                chain = LLMChain(llm=llm, prompt=prompt_template)
-            else : 
-                llm = ChatOpenAI(temperature=0)
-                prompt_template = PromptTemplate(
-                    input_variables=["original_output", "new_output"],
-                    template= how_to_evaluate + "\n\nHere are the original and new outputs:\n\nOriginal: {original_output}\n\nNew: {new_output} Answer the question with 'Yes' or 'No' and provide a brief explanation."
-                )
-                chain = LLMChain(llm=llm, prompt=prompt_template)
-            try:
-                for entry in entries:
-                    # There should either be ground truth or a how_to_evaluate prompt
-                    if entry.input and (how_to_evaluate or entry.ground_truth):
-                        new_output = entry.output
-                        # Compare output
-                        result = chain.run(original_output=entry.ground_truth, new_output=new_output)
-                        is_equivalent = result.strip().lower().startswith('yes')
-                        
-                        print(f"Process ID: {entry.process_id}, System: {entry.agent_name}")
-                        print(f"Original output: {entry.output}")
-                        print(f"New output: {new_output}")
-                        print(f"Equivalent: {is_equivalent}")
-                        print(f"LLM explanation: {result}")
-                        print("---")
-
-                        # Update the database entry
-                        entry.is_correct = is_equivalent
-                        if not is_equivalent:
-                            entry.reason = result
-                        entry.how_to_evaluate = how_to_evaluate
-                        if not how_to_evaluate:
-                            entry.how_to_evaluate = "Compare the ground truth, new outputs for semantic equivalence."
+                entries = entries.filter(TestCase.ground_truth.isnot(None), TestCase.ground_truth != "")
+            if inputs is not None:
+                entries = entries.filter(TestCase.input.in_(inputs))
+            total = entries.count()
+            entries = (
+                entries.filter(or_(TestCase.is_correct.is_(None), TestCase.how_to_evaluate.is_(None), TestCase.how_to_evaluate != evaluation_label))
+                .order_by(TestCase.process_id, TestCase.id)
+                .all()
+            )
+            already_judged = total - len(entries)
+            run.total = total
+            run.completed = already_judged
+            db.session.commit()
+
+            to_judge = [entry._asdict() for entry in entries]
+            db.session.close()
+            if already_judged:
+                print(f"Skipping {already_judged} already judged test cases")
+
+            limiter = RateLimiter(requests_per_minute)
+            if evaluators is None:
+                evaluators = pipeline_for(how_to_evaluate)
+            decided_locally = 0
+
+            def judge(row):
+                result = self.judge(render_evaluation_prompt(how_to_evaluate, row["ground_truth"], row["output"]), limiter)
+                is_equivalent = result.strip().lower().startswith('yes')
+                return is_equivalent, result
+
+            with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+                try:
+                    for chunk_start in range(0, len(to_judge), chunk_size):
+                        chunk = to_judge[chunk_start:chunk_start + chunk_size]
+                        verdicts = evaluators.evaluate(chunk)
+                        judged = {i: executor.submit(judge, row) for i, (row, verdict) in enumerate(zip(chunk, verdicts)) if verdict is None}
+                        decided_locally += len(chunk) - len(judged)
+
+                        mappings = []
+                        failure = None
+                        for i, (row, verdict) in enumerate(zip(chunk, verdicts)):
+                            if verdict is None:
+                                try:
+                                    is_equivalent, result = judged[i].result()
+                                except Exception as error:
+                                    # The row stays unjudged for a resume; the verdicts already received are still saved below.
+                                    failure = failure or error
+                                    continue
+                                explanation = f"LLM explanation: {result}"
+                            else:
+                                is_equivalent, result, evaluator_name = verdict
+                                explanation = f"Decided by {evaluator_name} check" + (f": {result}" if result else "")
+
+                            print(f"Process ID: {row['process_id']}, System: {row['agent_name']}")
+                            print(f"Original output: {row['ground_truth']}")
+                            print(f"New output: {row['output']}")
+                            print(f"Equivalent: {is_equivalent}")
+                            print(explanation)
+                            print("---")
+
+                            mapping = {"id": row["id"], "is_correct": is_equivalent, "how_to_evaluate": evaluation_label}
+                            if not is_equivalent:
+                                mapping["reason"] = result
+                            mappings.append(mapping)
+
+                        # Update the database entries and the run's progress for this chunk in one transaction
+                        db.session.bulk_update_mappings(TestCase, mappings)
+                        self.update_evaluation_run(run_id, completed=EvaluationRun.completed + len(mappings))
                         db.session.commit()
+                        if failure is not None:
+                            raise failure
+                except Exception as error:
+                    db.session.rollback()
+                    self.update_evaluation_run(run_id, status="failed", error=f"{type(error).__name__}: {error}")
+                    db.session.commit()
+                    raise
+                else:
+                    self.update_evaluation_run(run_id, status="done", finished_at=datetime.utcnow())
+                    db.session.commit()
+                    print(f"Evaluators decided {decided_locally} of {len(to_judge)} test cases; {len(to_judge) - decided_locally} went to the LLM judge")
+                finally:
+                    db.session.close()
+        return run_id
 
-            finally:
-                db.session.close()
+    def update_evaluation_run(self, run_id: int, **changes):
+        db.session.query(EvaluationRun).filter(EvaluationRun.id == run_id).update({**changes, "updated_at": datetime.utcnow()}, synchronize_session=False)
     
-    def evaluate_complete_unit_test(self, running_function, prompt, who_to_evaluate: str, how_to_evaluate: str = None):
+    # Rerunning with the same prompt only generates and judges what is missing; run_id resumes an earlier evaluation run
+    # with its own prompt, agent and evaluation instead of the ones passed in.
+    # Setting target or max_samples switches to a sampled evaluation and returns its report instead of the score,
+    # see evaluate_sampled_unit_test; its sampling options are passed on when set and keep their defaults otherwise.
+    def evaluate_complete_unit_test(self, running_function, prompt: str = None, who_to_evaluate: str = None, how_to_evaluate: str = None, max_concurrency: int = 1, requests_per_minute: float = None, run_id: int = None, evaluators=None, target: float = None, max_samples: int = None, confidence: float = 0.95,
+                                    batch_size: int = None, min_samples: int = None, stratify_by=None, seed: int = None, cache_namespace: str = None):
         if not self.do_db_actions:
             return None
+        if target is not None or max_samples is not None:
+            sampling_options = {"max_samples": max_samples, "batch_size": batch_size, "min_samples": min_samples, "stratify_by": stratify_by, "seed": seed}
+            return self.evaluate_sampled_unit_test(running_function, prompt, who_to_evaluate, how_to_evaluate, target=target, confidence=confidence,
+                                                   max_concurrency=max_concurrency, requests_per_minute=requests_per_minute, evaluators=evaluators, cache_namespace=cache_namespace,
+                                                   **{name: value for name, value in sampling_options.items() if value is not None})
         from prompt_config import Config
+        self.flush()
+        if run_id is not None:
+            with self.app.app_context():
+                run = db.session.get(EvaluationRun, run_id)
+                if run is None:
+                    raise ValueError(f"Evaluation run {run_id} does not exist")
+                prompt_id, who_to_evaluate, how_to_evaluate = run.prompt_id, run.agent_name, run.how_to_evaluate
+                prompt = db.session.get(Prompt, prompt_id).prompt
+        else:
+            prompt_id = self.save_prompt_to_table(prompt, who_to_evaluate, "gemini-1.5-flash")
         Config[who_to_evaluate] = prompt
-        prompt_id = self.save_prompt_to_table(prompt, who_to_evaluate, "gemini-1.5-flash")
-        self.generate_new_prompt_outputs(running_function = running_function, prompt_id = prompt_id)
-        self.evaluate_latest_prompt_outputs(how_to_evaluate = how_to_evaluate, who_to_evaluate = who_to_evaluate, prompt_id = prompt_id)
+        self.generate_new_prompt_outputs(running_function = running_function, prompt_id = prompt_id, max_concurrency = max_concurrency, agent_name = who_to_evaluate, cache_namespace = cache_namespace)
+        self.evaluate_latest_prompt_outputs(how_to_evaluate = how_to_evaluate, who_to_evaluate = who_to_evaluate, prompt_id = prompt_id, max_concurrency = max_concurrency, requests_per_minute = requests_per_minute, run_id = run_id, evaluators = evaluators)
+        if self.cache is not None:
+            print(f"LLM cache: {self.cache.stats()}")
         return self.get_reliability_score(who_to_evaluate, prompt_id)
 
+    # Estimates the reliability score of prompt from a sample of the stored inputs instead of all of them.
+    # Inputs are drawn in batches of batch_size, stratified by stratify_by(entry) (by default the prompt the input was first
+    # logged with; pass e.g. a topic or cluster key) so every stratum is represented in proportion, and each batch is
+    # generated and judged like a full run. After every batch the score (0-100) of the sampled rows judged so far gets a
+    # Wilson confidence interval; with a target, sampling stops once at least min_samples are judged and the interval lies
+    # entirely above or below it.
+    # The interval is not corrected for checking after every batch, so use a high confidence for go/no-go decisions.
+    def evaluate_sampled_unit_test(self, running_function, prompt: str, who_to_evaluate: str, how_to_evaluate: str = None, target: float = None, confidence: float = 0.95, batch_size: int = 50, min_samples: int = 30, max_samples: int = 1000, stratify_by=None, seed: int = None, max_concurrency: int = 1, requests_per_minute: float = None, evaluators=None, cache_namespace: str = None) -> dict:
+        if not self.do_db_actions:
+            return None
+        import sampling
+        from prompt_config import Config
+
+        self.flush()
+        prompt_id = self.save_prompt_to_table(prompt, who_to_evaluate, "gemini-1.5-flash")
+        Config[who_to_evaluate] = prompt
+        with self.app.app_context():
+            population = self.get_distinct_input_entries(who_to_evaluate)
+            db.session.close()
+        sample_order = sampling.stratified_order(population, stratify_by or (lambda entry: entry.prompt_id), seed)
+        if max_samples is not None:
+            sample_order = sample_order[:max_samples]
+
+        evaluation_label = how_to_evaluate if how_to_evaluate else DEFAULT_EVALUATION_LABEL
+        sampled_count, total, correct = 0, 0, 0
+        run_id = None
+        report = {"prompt_id": prompt_id, "population": len(population), "confidence": confidence, "target": target,
+                  "samples": 0, "score": None, "low": 0.0, "high": 100.0, "decision": "undecided"}
+        for batch_start in range(0, len(sample_order), batch_size):
+            # Each batch is generated, judged and counted on its own inputs, so queries stay the size of a batch.
+            batch_inputs = [entry.input for entry in sample_order[batch_start:batch_start + batch_size]]
+            sampled_count += len(batch_inputs)
+            self.generate_new_prompt_outputs(running_function, prompt_id, max_concurrency=max_concurrency, agent_name=who_to_evaluate, inputs=batch_inputs, cache_namespace=cache_namespace)
+            run_id = self.evaluate_latest_prompt_outputs(how_to_evaluate, who_to_evaluate, prompt_id, max_concurrency=max_concurrency, requests_per_minute=requests_per_minute,
+                                                         run_id=run_id, evaluators=evaluators, inputs=batch_inputs)
+
+            # Only rows judged by this evaluation count; rows that could not be judged (e.g. no ground truth) are no evidence.
+            batch_total, batch_correct = self.get_reliability_counts(who_to_evaluate, prompt_id, inputs=batch_inputs, evaluation_label=evaluation_label)
+            total, correct = total + batch_total, correct + batch_correct
+            low, high = sampling.wilson_interval(correct, total, confidence)
+            report.update(samples=total, score=100 * correct / total if total else None, low=low, high=high, evaluation_run_id=run_id)
+            with self.app.app_context():
+                # The run covers every sampled row so far, not only the last batch
+                self.update_evaluation_run(run_id, total=total, completed=total)
+                db.session.commit()
+            if total:
+                print(f"Sampled {sampled_count} of {len(population)} inputs, {total} judged: reliability {report['score']:.1f}% "
+                      f"({confidence:.0%} interval {low:.1f}-{high:.1f})")
+            else:
+                print(f"Sampled {sampled_count} of {len(population)} inputs, none could be judged yet")
+            if target is not None and total >= min_samples:
+                if low > target:
+                    report["decision"] = "above"
+                elif high < target:
+                    report["decision"] = "below"
+                if report["decision"] != "undecided":
+                    print(f"Stopping early: reliability is {report['decision']} the target of {target}%")
+                    break
+        report["exhaustive"] = sampled_count == len(population)
+        return report
+
+    # Evaluates several candidate prompts for an agent in one pass, e.g. a baseline against improvements from /prompts/<id>/improve.
+    # prompts are prompt texts or ids of stored prompts. All candidates share the agent's deduplicated inputs, and outputs for
+    # the whole (prompt x input) matrix are generated concurrently, each prompt passed as running_function(inputs=..., prompt=...).
+    # Running functions without a prompt argument are run one prompt at a time through prompt_config.Config instead.
+    # Returns one row per prompt, best reliability first, and prints them as a comparison table.
+    def evaluate_prompt_matrix(self, running_function, prompts: list, who_to_evaluate: str, how_to_evaluate: str = None, max_concurrency: int = 8, requests_per_minute: float = None, evaluators=None, cache_namespace: str = None) -> list:
+        if not self.do_db_actions:
+            return None
+        self.flush()
+        prompt_ids = []
+        for prompt in prompts:
+            prompt_id = prompt if isinstance(prompt, int) else self.save_prompt_to_table(prompt, who_to_evaluate, "gemini-1.5-flash")
+            if prompt_id not in prompt_ids:
+                prompt_ids.append(prompt_id)
+
+        if accepts_prompt(running_function):
+            self.generate_prompt_matrix_outputs(running_function, prompt_ids, max_concurrency=max_concurrency, agent_name=who_to_evaluate, cache_namespace=cache_namespace)
+        else:
+            from prompt_config import Config
+            with self.app.app_context():
+                prompt_texts = dict(db.session.query(Prompt.id, Prompt.prompt).filter(Prompt.id.in_(prompt_ids)).all())
+            had_prompt, previous_prompt = who_to_evaluate in Config, Config.get(who_to_evaluate)
+            try:
+                for prompt_id in prompt_ids:
+                    Config[who_to_evaluate] = prompt_texts[prompt_id]
+                    self.generate_new_prompt_outputs(running_function, prompt_id, max_concurrency=max_concurrency, agent_name=who_to_evaluate, cache_namespace=cache_namespace)
+            finally:
+                if had_prompt:
+                    Config[who_to_evaluate] = previous_prompt
+                else:
+                    Config.pop(who_to_evaluate, None)
+
+        for prompt_id in prompt_ids:
+            self.evaluate_latest_prompt_outputs(how_to_evaluate, who_to_evaluate, prompt_id, max_concurrency=max_concurrency, requests_per_minute=requests_per_minute, evaluators=evaluators)
+        if self.cache is not None:
+            print(f"LLM cache: {self.cache.stats()}")
+        rows = self.get_prompt_comparison(who_to_evaluate, prompt_ids)
+        print(format_prompt_comparison(rows))
+        return rows
+
+    # Reliability, latency percentiles of the regenerated outputs and mean tokens per call, per prompt.
+    def get_prompt_comparison(self, agent_name: str, prompt_ids: list) -> list:
+        from load_test import percentile
+
+        rows = []
+        with self.app.app_context():
+            prompt_texts = dict(db.session.query(Prompt.id, Prompt.prompt).filter(Prompt.id.in_(prompt_ids)).all())
+            for prompt_id in prompt_ids:
+                test_cases = db.session.query(TestCase).filter(TestCase.agent_name == agent_name, TestCase.prompt_id == prompt_id)
+                latencies = sorted(latency for (latency,) in test_cases.filter(TestCase.latency_ms.isnot(None)).with_entities(TestCase.latency_ms))
+                mean_tokens = test_cases.with_entities(func.avg(TestCase.prompt_tokens + TestCase.completion_tokens)).scalar()
+                total, correct = self.get_reliability_counts(agent_name, prompt_id)
+                rows.append({
+                    "prompt_id": prompt_id,
+                    "prompt": prompt_texts.get(prompt_id),
+                    "reliability": 100 * correct / total if total else 0,
+                    "test_cases": total,
+                    "p50_ms": percentile(latencies, 50),
+                    "p90_ms": percentile(latencies, 90),
+                    "mean_tokens": mean_tokens,
+                })
+        rows.sort(key=lambda row: row["reliability"], reverse=True)
+        return rows
+
+    # Applies load to running_function using the stored distinct inputs as the corpus and reports latency percentiles,
+    # throughput and error rate overall, per agent and per prompt_id. Running functions that return a stream of chunks also
+    # get time-to-first-token percentiles. See load_test.run_load for the load options.
+    # Unless log_calls is set, the agent's own logging is suppressed so the run measures the agent, not the database.
+    def run_load(self, running_function, agent_name: str = None, prompt_id: int = None, concurrency: int = 8, rate: float = None, duration: float = None, iterations: int = None, timeout: float = None, log_calls: bool = False):
+        import load_test
+
+        self.flush()
+        with self.app.app_context():
+            corpus = [entry._asdict() for entry in self.get_distinct_input_entries(agent_name, prompt_id)]
+
+        def suppressed_stream(chunks):
+            # A streamed answer does its work (and its logging) while it is read, so keep it quiet until the end.
+            with self.suppress_db_actions():
+                yield from chunks
+
+        def call(inputs):
+            if log_calls:
+                return running_function(inputs=inputs)
+            with self.suppress_db_actions():
+                output = running_function(inputs=inputs)
+            return suppressed_stream(output) if is_stream(output) else output
+
+        records, wall_seconds = load_test.run_load(call, corpus, concurrency=concurrency, rate=rate, duration=duration, iterations=iterations, timeout=timeout)
+        return load_test.build_report(records, wall_seconds)
+
     def get_reliability_score(self, agent_name: str, prompt_id: int):
+        total, correct = self.get_reliability_counts(agent_name, prompt_id)
+        return 100 * correct / total if total else 0
+
+    # (test cases, test cases counted as correct) of a prompt, optionally only for some inputs and only rows judged under evaluation_label.
+    def get_reliability_counts(self, agent_name: str, prompt_id: int, inputs: list = None, evaluation_label: str = None) -> tuple:
         with self.app.app_context():
-            entries = TestCase.query.filter_by(agent_name=agent_name, prompt_id=prompt_id).all()
-            correct_entries = [entry for entry in entries if entry.is_correct and 'equivalence' in entry.how_to_evaluate.lower()]
-            return 100 * len(correct_entries) / len(entries)
+            # Only verdicts from an evaluation count, not is_correct values the agent logged itself
+            is_counted_correct = and_(TestCase.is_correct.is_(True), TestCase.how_to_evaluate.isnot(None))
+            query = (
+                db.session.query(func.count(TestCase.id), func.coalesce(func.sum(case((is_counted_correct, 1), else_=0)), 0))
+                .filter(TestCase.agent_name == agent_name, TestCase.prompt_id == prompt_id)
+            )
+            if inputs is not None:
+                query = query.filter(TestCase.input.in_(inputs))
+            if evaluation_label is not None:
+                query = query.filter(TestCase.how_to_evaluate == evaluation_label, TestCase.is_correct.isnot(None))
+            return tuple(query.one())
 
     def get_best_prompts(self, agent_name: str):
-        from langchain.llms import OpenAI
-        from langchain.prompts import PromptTemplate
-        from langchain.chains import LLMChain
-        import json
-
         with self.app.app_context():
-            entries = TestCase.query.filter_by(agent_name=agent_name).all()
+            entries = (
+                db.session.query(TestCase.input, TestCase.output, TestCase.is_correct, Prompt.prompt)
+                .outerjoin(Prompt, TestCase.prompt_id == Prompt.id)
+                .filter(TestCase.agent_name == agent_name)
+                .all()
+            )
 
             correct_entries = []
             incorrect_entries = []
@@ -265,98 +889,128 @@ class LLMLogger:
                     correct_entries.append({
                         'input': entry.input,
                         'output': entry.output,
-                        'prompts': json.loads(entry.prompts)
+                        'prompt': entry.prompt
                     })
                 else:
                     incorrect_entries.append({
                         'input': entry.input,
                         'output': entry.output,
-                        'prompts': json.loads(entry.prompts)
+                        'prompt': entry.prompt
                     })
 
-            llm = OpenAI(temperature=0.7)
-            prompt_template = PromptTemplate(
-                input_variables=["correct_entries", "incorrect_entries"],
-                template="Given the following correct and incorrect input-output pairs with their associated prompts, generate an optimal prompt for each variable:\n\nCorrect entries: {correct_entries}\n\nIncorrect entries: {incorrect_entries}\n\nGenerate optimal prompts:"
-            )
-            chain = LLMChain(llm=llm, prompt=prompt_template)
-
-            result = chain.run(correct_entries=str(correct_entries), incorrect_entries=str(incorrect_entries))
+            prompt = f"Given the following correct and incorrect input-output pairs with their associated prompts, generate an optimal prompt for each variable:\n\nCorrect entries: {correct_entries}\n\nIncorrect entries: {incorrect_entries}\n\nGenerate optimal prompts:"
+            result = self.generation_provider.generate(prompt, temperature=0.7).text
             
             # And then maybe after this iteratively generate new prompts, see which ones it fails at the most, and especially focus on getting those right.
             return result
     
-    def fill_template(self, template: str, **kwargs) -> str:
-        # Function to replace placeholders with actual values
-        def fill_template(template, **kwargs):
-            return template.format(**{k: '{' + k + '}' for k in kwargs.keys()}).format(**kwargs)
-        # Fill the template with actual values
-        prompt_to_return = fill_template(template, **kwargs)
-        return prompt_to_return
+    # Bulk-loads a JSONL corpus of input/ground_truth/agent_name records as test cases of the current process.
+    def import_corpus(self, path: str, agent_name: str = None, batch_size: int = 5000) -> dict:
+        import corpus_import
 
+        self.flush()
+        with self.app.app_context():
+            return corpus_import.import_corpus(path, agent_name=agent_name, process_id=self.process_id, batch_size=batch_size)
 
-    def generate_remaining_input_outputs(self, agent_name: str, number_of_items_to_generate: int = 5, prompt_to_aid_generation: str = None):
-        from openai import OpenAI
-        import json
-        import os
-        from dotenv import load_dotenv
+    # Renders a prompt template ({{name}} placeholders) through the compiled-template cache.
+    # Raises KeyError listing every missing variable; extra variables are ignored.
+    def fill_template(self, template: str, **kwargs) -> str:
+        return compile_template(template).render(**kwargs)
 
-        # Load environment variables and set OpenAI API key
-        load_dotenv()
-        api_key=os.getenv("OPENAI_API_KEY")
-        client = OpenAI(api_key=api_key)
+    # Synthesizes new input/output pairs for agent_name from its correct test cases.
+    # The pairs are requested in batches of pairs_per_request, on max_concurrency threads. Each request gets its own sample of
+    # seed pairs, drawn evenly across prompts until seed_token_budget is used, so the prompt stays small however big the corpus is.
+    # Pairs whose input is already stored for the agent (or was generated earlier in this call) are dropped, and missing
+    # pairs are requested again for up to max_rounds rounds. Returns the pairs that were inserted.
+    def generate_remaining_input_outputs(self, agent_name: str, number_of_items_to_generate: int = 5, prompt_to_aid_generation: str = None, pairs_per_request: int = 20, seed_token_budget: int = 3000, max_concurrency: int = 4, max_rounds: int = 3, seed: int = None):
+        import corpus_import
+        from backend.llm_service import estimate_tokens
 
         with self.app.app_context():
-            correct_entries = TestCase.query.filter_by(agent_name=agent_name, is_correct=True).all()
-
+            correct_entries = (
+                db.session.query(TestCase.input, TestCase.output, TestCase.prompt_id)
+                .filter(TestCase.agent_name == agent_name, TestCase.is_correct.is_(True))
+                .all()
+            )
             if not correct_entries:
                 return []
+            # Generated pairs are attached to the agent's latest prompt
+            prompt_id = db.session.query(func.max(TestCase.prompt_id)).filter(TestCase.agent_name == agent_name).scalar()
+            seen = corpus_import.load_corpus_keys(agent_name)
+            db.session.close()
 
-            correct_pairs = [{"input": entry.input, "output": entry.output} for entry in correct_entries]
+        # Without a seed every call draws different samples; with one, the samples are reproducible.
+        base_seed = seed if seed is not None else random.SystemRandom().randrange(2 ** 32)
+        seeds_by_prompt = {}
+        for entry in correct_entries:
+            seeds_by_prompt.setdefault(entry.prompt_id, []).append({"input": entry.input, "output": entry.output})
 
+        def sample_seed_pairs(request_number):
+            # Round-robin over prompts, a random pair from each, until the token budget is spent.
+            rng = random.Random(f"{base_seed}:{request_number}")
+            strata = [rng.sample(pairs, len(pairs)) for pairs in seeds_by_prompt.values()]
+            sample, used_tokens = [], 0
+            while any(strata):
+                for stratum in strata:
+                    if not stratum:
+                        continue
+                    pair = stratum.pop()
+                    pair_tokens = estimate_tokens(json.dumps(pair))
+                    if sample and used_tokens + pair_tokens > seed_token_budget:
+                        return sample
+                    sample.append(pair)
+                    used_tokens += pair_tokens
+            return sample
+
+        def request_pairs(request_number, count):
             prompt = f"""
             Given the following correct input-output pairs:
-            {json.dumps(correct_pairs, indent=2)}
+            {json.dumps(sample_seed_pairs(request_number), indent=2)}
 
-            Generate {number_of_items_to_generate} new input-output pairs that are similar in style and complexity, but different in content. 
+            Generate {count} new input-output pairs that are similar in style and complexity, but different in content. 
             Ensure that the new pairs maintain the same pattern or logic as the given examples.
-            Format your response as a Python list of dictionaries, each containing 'input' and 'output' keys.
+            Format your response as a JSON list of objects, each containing 'input' and 'output' keys.
             """
-
             if prompt_to_aid_generation:
                 prompt = "Keep the below guidelines in mind when generating the new input-output pairs:\n" + prompt_to_aid_generation + "\n\n" + prompt
-
+            result = self.generation_provider.generate(prompt, system="You are a helpful assistant that generates input-output pairs.", temperature=0.0).text
+            # Tolerate code fences or prose around the list
+            start, end = result.find("["), result.rfind("]")
             try:
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a helpful assistant that generates input-output pairs."},
-                        {"role": "user", "content": prompt}
-                    ],
-                    temperature=0.0
-                )
-                
-                result = response.choices[0].message.content
-            
-                #Trim result to only the part within '''json'''
-                #result = result.split('```json')[1].split('```')[0]
-
-                new_pairs = json.loads(result)
-
-                # Append all the new pairs to the database
-                for pair in new_pairs:
-                    # Get the highest prior prompt_id for the agent_name
-                    highest_prompt = db.session.query(TestCase).filter_by(agent_name=agent_name).order_by(TestCase.prompt_id.desc()).first()
-                    prompt_id = highest_prompt.prompt_id if highest_prompt else None
-                    # No prompts key here means that these are llm generated samples, not based on a certain prompt.
-                    new_entry = TestCase(process_id=self.process_id, input=pair['input'], output=pair['output'], agent_name=agent_name, prompt_id = prompt_id)
-                    db.session.add(new_entry)
-                db.session.commit()
-
-                return new_pairs
+                pairs = json.loads(result[start:end + 1] if start != -1 else result)
             except json.JSONDecodeError:
                 print("Error: Unable to parse the generated output as JSON.")
                 return []
+            return [pair for pair in pairs if isinstance(pair, dict) and isinstance(pair.get("input"), str) and pair["input"]]
+
+        new_pairs = []
+        request_number = 0
+        with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as executor:
+            for _ in range(max_rounds):
+                remaining = number_of_items_to_generate - len(new_pairs)
+                if remaining <= 0:
+                    break
+                counts = [min(pairs_per_request, remaining - start) for start in range(0, remaining, pairs_per_request)]
+                futures = [executor.submit(request_pairs, request_number + i, count) for i, count in enumerate(counts)]
+                request_number += len(counts)
+                for future in futures:
+                    for pair in future.result():
+                        key = corpus_import.corpus_key(agent_name, pair["input"])
+                        if key in seen or len(new_pairs) >= number_of_items_to_generate:
+                            continue
+                        seen.add(key)
+                        output = pair.get("output")
+                        new_pairs.append({"input": pair["input"], "output": output if output is None or isinstance(output, str) else json.dumps(output)})
+
+        if not new_pairs:
+            return []
+        with self.app.app_context():
+            db.session.execute(insert(TestCase), [
+                {"process_id": self.process_id, "input": pair["input"], "output": pair["output"], "agent_name": agent_name, "prompt_id": prompt_id}
+                for pair in new_pairs
+            ])
+            db.session.commit()
+        return new_pairs
 
 # Usage example
 def main():
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend', 'llm_cache.db')
+
+
+# Persistent, content-addressed cache for LLM results (judge verdicts and regenerated outputs).
+# Entries live in a small SQLite file next to database.db and are evicted by TTL and by least-recent use.
+class LLMCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = 100_000, ttl_seconds: float = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_last_used_at ON llm_cache (last_used_at)")
+        self.connection.commit()
+        self.writes_since_eviction = 0
+
+    @staticmethod
+    def make_key(model: str, prompt: str, input: str, template: str = None, temperature: float = None, **extra) -> str:
+        # Everything that can change the model's answer goes into the key.
+        payload = json.dumps([model, prompt, input, template, temperature, sorted(extra.items())], default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None or (self.ttl_seconds is not None and now - row[1] > self.ttl_seconds):
+                self.misses += 1
+                return None
+            self.connection.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (now, key))
+            self.connection.commit()
+            self.hits += 1
+            return json.loads(row[0])
+
+    def set(self, key: str, value):
+        now = time.time()
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at, last_used_at) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now, now)
+            )
+            self.writes_since_eviction += 1
+            # Checking the size on every write would cost a COUNT per call; do it in batches instead.
+            if self.writes_since_eviction >= 100:
+                self.evict()
+            self.connection.commit()
+
+    def get_or_compute(self, key: str, compute):
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.set(key, value)
+        return value
+
+    def evict(self):
+        # Caller must hold self.lock.
+        self.writes_since_eviction = 0
+        if self.ttl_seconds is not None:
+            self.connection.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        count = self.connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY last_used_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def clear(self):
+        with self.lock:
+            self.connection.execute("DELETE FROM llm_cache")
+            self.connection.commit()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            entries = self.connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "entries": entries}
@@ -0,0 +1,255 @@
+import argparse
+import importlib
+import itertools
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from providers import is_stream
+
+
+def percentile(sorted_values: list, p: float):
+    # Linear interpolation between closest ranks; sorted_values must already be sorted.
+    if not sorted_values:
+        return None
+    position = (len(sorted_values) - 1) * p / 100
+    lower = int(position)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+# A running_function stand-in with configurable latency and failures, so the harness can be benchmarked offline.
+# With stream_chunks, it streams that many chunks instead: the first one after the sampled latency, then one every inter_chunk_ms.
+def make_stub_function(latency_ms: float = 50, jitter_ms: float = 10, failure_rate: float = 0.0, seed: int = None, stream_chunks: int = 0, inter_chunk_ms: float = 5):
+    rng = random.Random(seed)
+    rng_lock = threading.Lock()
+
+    def stream_answer(inputs: str, delay: float, fail: bool):
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("stub failure")
+        for i in range(stream_chunks):
+            if i:
+                time.sleep(inter_chunk_ms / 1000)
+            yield f"stub chunk {i} for: {inputs} "
+
+    def stub_function(inputs: str) -> str:
+        with rng_lock:
+            delay = max(0.0, rng.gauss(latency_ms, jitter_ms)) / 1000
+            fail = rng.random() < failure_rate
+        if stream_chunks:
+            return stream_answer(inputs, delay, fail)
+        time.sleep(delay)
+        if fail:
+            raise RuntimeError("stub failure")
+        return f"stub answer to: {inputs}"
+
+    return stub_function
+
+
+# Streamed answers (functions returning an iterator of chunks) are read to the end; ttft_ms is the time to their first chunk.
+def timed_call(function, item: dict, timeout: float, scheduled_at: float = None) -> dict:
+    started_at = time.perf_counter()
+    record = {"agent_name": item.get("agent_name"), "prompt_id": item.get("prompt_id"), "status": "ok", "error": None}
+    first_chunk_at = None
+    try:
+        result = function(inputs=item["input"])
+        if is_stream(result):
+            for _ in result:
+                if first_chunk_at is None:
+                    first_chunk_at = time.perf_counter()
+    except Exception as error:
+        record["status"] = "error"
+        record["error"] = type(error).__name__
+    finished_at = time.perf_counter()
+    # In rate mode latency is measured from when the request was due, so queueing behind slow calls is not hidden.
+    origin = scheduled_at if scheduled_at is not None else started_at
+    record["latency_ms"] = (finished_at - origin) * 1000
+    record["ttft_ms"] = (first_chunk_at - origin) * 1000 if first_chunk_at is not None else None
+    if timeout is not None and record["status"] == "ok" and finished_at - started_at > timeout:
+        record["status"] = "timeout"
+    return record
+
+
+# Drives function over the corpus and returns (records, wall_seconds).
+# Without rate: closed loop, `concurrency` workers each issue the next call as soon as the previous one returns.
+# With rate: open loop, calls are issued at `rate` per second onto a pool of `concurrency` workers.
+# Stops after `iterations` calls or `duration` seconds, whichever comes first; with neither, the corpus is replayed once.
+# timeout is in seconds; calls that run longer are reported as timeouts (threads cannot be interrupted, so they still finish).
+def run_load(function, corpus: list, concurrency: int = 8, rate: float = None, duration: float = None, iterations: int = None, timeout: float = None):
+    if not corpus:
+        raise ValueError("The load corpus is empty; store some test cases first.")
+    if iterations is None and duration is None:
+        iterations = len(corpus)
+
+    records = []
+    records_lock = threading.Lock()
+    counter = itertools.count()
+    started_at = time.perf_counter()
+    deadline = started_at + duration if duration is not None else None
+
+    def next_index():
+        index = next(counter)
+        if iterations is not None and index >= iterations:
+            return None
+        if deadline is not None and time.perf_counter() >= deadline:
+            return None
+        return index
+
+    if rate is None:
+        def worker():
+            while True:
+                index = next_index()
+                if index is None:
+                    return
+                record = timed_call(function, corpus[index % len(corpus)], timeout)
+                with records_lock:
+                    records.append(record)
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    else:
+        futures = []
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while True:
+                index = next_index()
+                if index is None:
+                    break
+                scheduled_at = started_at + index / rate
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                futures.append(executor.submit(timed_call, function, corpus[index % len(corpus)], timeout, scheduled_at))
+        records = [future.result() for future in futures]
+
+    return records, time.perf_counter() - started_at
+
+
+def summarize_records(records: list, wall_seconds: float) -> dict:
+    latencies = sorted(r["latency_ms"] for r in records if r["status"] == "ok")
+    ttfts = sorted(r["ttft_ms"] for r in records if r["status"] == "ok" and r.get("ttft_ms") is not None)
+    count = len(records)
+    errors = sum(1 for r in records if r["status"] == "error")
+    timeouts = sum(1 for r in records if r["status"] == "timeout")
+    error_types = {}
+    for r in records:
+        if r["error"]:
+            error_types[r["error"]] = error_types.get(r["error"], 0) + 1
+    return {
+        "count": count,
+        "ok": len(latencies),
+        "errors": errors,
+        "timeouts": timeouts,
+        "error_rate": (errors + timeouts) / count if count else 0,
+        "throughput_rps": len(latencies) / wall_seconds if wall_seconds else 0,
+        "p50_ms": percentile(latencies, 50),
+        "p90_ms": percentile(latencies, 90),
+        "p99_ms": percentile(latencies, 99),
+        "mean_ms": sum(latencies) / len(latencies) if latencies else None,
+        "max_ms": latencies[-1] if latencies else None,
+        "streamed": len(ttfts),
+        "ttft_p50_ms": percentile(ttfts, 50),
+        "ttft_p90_ms": percentile(ttfts, 90),
+        "ttft_p99_ms": percentile(ttfts, 99),
+        "error_types": error_types,
+    }
+
+
+def build_report(records: list, wall_seconds: float) -> dict:
+    report = {"wall_seconds": wall_seconds, "overall": summarize_records(records, wall_seconds), "by_agent": {}, "by_prompt_id": {}}
+    for group_key, group_name in (("agent_name", "by_agent"), ("prompt_id", "by_prompt_id")):
+        groups = {}
+        for r in records:
+            groups.setdefault(r[group_key], []).append(r)
+        report[group_name] = {key: summarize_records(group, wall_seconds) for key, group in groups.items()}
+    return report
+
+
+def format_report(report: dict) -> str:
+    def format_ms(value):
+        return f"{value:.1f}" if value is not None else "-"
+
+    header = (f"{'group':<30} {'calls':>7} {'rps':>8} {'err%':>6} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+              f"{'ttft p50':>9} {'ttft p90':>9} {'ttft p99':>9}")
+    lines = [f"Load run finished in {report['wall_seconds']:.2f}s", header, "-" * len(header)]
+
+    def add_line(name, stats):
+        lines.append(
+            f"{str(name):<30} {stats['count']:>7} {stats['throughput_rps']:>8.2f} {100 * stats['error_rate']:>6.1f} "
+            f"{format_ms(stats['p50_ms']):>9} {format_ms(stats['p90_ms']):>9} {format_ms(stats['p99_ms']):>9} "
+            f"{format_ms(stats['ttft_p50_ms']):>9} {format_ms(stats['ttft_p90_ms']):>9} {format_ms(stats['ttft_p99_ms']):>9}"
+        )
+
+    add_line("overall", report["overall"])
+    for agent_name, stats in report["by_agent"].items():
+        add_line(f"agent={agent_name}", stats)
+    for prompt_id, stats in report["by_prompt_id"].items():
+        add_line(f"prompt_id={prompt_id}", stats)
+    if report["overall"]["error_types"]:
+        lines.append(f"errors: {report['overall']['error_types']}")
+    return "\n".join(lines)
+
+
+def load_function(target: str):
+    # "package.module:function"
+    module_name, function_name = target.split(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive an instrumented agent with the stored test case inputs and report latency percentiles.")
+    parser.add_argument("--target", help="running function as module:function, e.g. example.chatbot:answer_user_question")
+    parser.add_argument("--stub", action="store_true", help="use a local stub function instead of a real agent (no network)")
+    parser.add_argument("--stub-latency-ms", type=float, default=50)
+    parser.add_argument("--stub-jitter-ms", type=float, default=10)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.0)
+    parser.add_argument("--stub-stream-chunks", type=int, default=0, help="make the stub stream this many chunks (reports time to first token)")
+    parser.add_argument("--stub-inter-chunk-ms", type=float, default=5)
+    parser.add_argument("--agent-name", help="only use stored inputs of this agent")
+    parser.add_argument("--prompt-id", type=int, help="only use stored inputs of this prompt")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, help="target requests per second (open loop); default is closed loop")
+    parser.add_argument("--duration", type=float, help="seconds to run for")
+    parser.add_argument("--iterations", type=int, help="number of calls to make")
+    parser.add_argument("--timeout", type=float, help="seconds after which a call counts as a timeout")
+    parser.add_argument("--log-calls", action="store_true", help="let the agent keep logging its calls to the database")
+    args = parser.parse_args()
+
+    from backend.app import app
+    from library import LLMLogger
+
+    logger = None
+    if args.stub:
+        running_function = make_stub_function(args.stub_latency_ms, args.stub_jitter_ms, args.stub_failure_rate,
+                                              stream_chunks=args.stub_stream_chunks, inter_chunk_ms=args.stub_inter_chunk_ms)
+    elif args.target:
+        running_function = load_function(args.target)
+        # Reuse the agent's own logger so suppressing its database logging actually applies to it.
+        module_logger = getattr(importlib.import_module(running_function.__module__), "logger", None)
+        if isinstance(module_logger, LLMLogger):
+            logger = module_logger
+    else:
+        parser.error("either --target or --stub is required")
+
+    if logger is None:
+        logger = LLMLogger(app)
+    report = logger.run_load(
+        running_function,
+        agent_name=args.agent_name,
+        prompt_id=args.prompt_id,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        duration=args.duration,
+        iterations=args.iterations,
+        timeout=args.timeout,
+        log_calls=args.log_calls,
+    )
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
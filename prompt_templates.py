@@ -0,0 +1,61 @@
+import re
+import string
+from functools import lru_cache
+
+_formatter = string.Formatter()
+_CONVERSIONS = {"r": repr, "s": str, "a": ascii}
+
+
+class _KeepPlaceholders(dict):
+    # Turns every {name} of the first formatting pass back into {name}, whatever variables are passed.
+    def __missing__(self, key):
+        return "{" + key + "}"
+
+
+# A prompt template parsed once into literal text and fields, rendered with a single join.
+# Templates use the same syntax fill_template always accepted: {{name}} or {name} are placeholders, {{{{ and }}}} are literal braces.
+class CompiledTemplate:
+    def __init__(self, template: str):
+        self.template = template
+        # Same result as the first .format() pass fill_template used to do on every call
+        unescaped = template.format_map(_KeepPlaceholders())
+        # literals[i] is the text before fields[i]; the last literal is the text after the last field.
+        self.literals = [""]
+        self.fields = []
+        for literal, field_name, format_spec, conversion in _formatter.parse(unescaped):
+            self.literals[-1] += literal
+            if field_name is not None:
+                self.literals.append("")
+                if not field_name or field_name.isdigit():
+                    raise ValueError(f"Prompt templates only support named placeholders, got {{{field_name}}}")
+                root_name = re.split(r"[.\[]", field_name, maxsplit=1)[0]
+                self.fields.append((field_name, root_name, format_spec, _CONVERSIONS.get(conversion)))
+        self.placeholders = frozenset(root_name for _, root_name, _, _ in self.fields)
+
+    def render(self, **variables) -> str:
+        missing = self.placeholders.difference(variables)
+        if missing:
+            raise KeyError(f"Missing template variables: {', '.join(sorted(missing))}")
+        parts = []
+        for literal, (field_name, root_name, format_spec, convert) in zip(self.literals, self.fields):
+            parts.append(literal)
+            value = variables[root_name] if field_name == root_name else _formatter.get_field(field_name, (), variables)[0]
+            if convert is not None:
+                value = convert(value)
+            parts.append(value if type(value) is str and not format_spec else format(value, format_spec))
+        parts.append(self.literals[-1])
+        return "".join(parts)
+
+
+# Compiled templates are cached by their text, so Config templates are only parsed the first time they are used.
+@lru_cache(maxsize=256)
+def compile_template(template: str) -> CompiledTemplate:
+    return CompiledTemplate(template)
+
+
+def template_variables(template: str):
+    # Sorted placeholder names of a template, or None when the text is not a valid template (e.g. contains literal JSON).
+    try:
+        return sorted(compile_template(template).placeholders)
+    except (ValueError, IndexError, KeyError, AttributeError):
+        return None
@@ -0,0 +1,316 @@
+import asyncio
+from collections.abc import Iterator
+import hashlib
+import os
+import random
+import threading
+import time
+
+from rate_limiter import RateLimiter, is_rate_limit_error
+
+
+class Generation:
+    def __init__(self, text: str, model: str = None, prompt_tokens: int = None, completion_tokens: int = None, latency_ms: float = None):
+        self.text = text
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.latency_ms = latency_ms
+
+    def __repr__(self):
+        return f'<Generation {self.model}, {self.latency_ms}ms, {self.text[:40]!r}>'
+
+
+class ProviderError(Exception):
+    def __init__(self, message: str, status_code: int = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+# A streamed response (any iterator of chunks), as opposed to a complete answer. Strings are iterable but not iterators.
+def is_stream(value) -> bool:
+    return isinstance(value, Iterator)
+
+
+def is_retryable_error(error: Exception) -> bool:
+    if is_rate_limit_error(error):
+        return True
+    status_code = getattr(error, "status_code", None)
+    if status_code is not None:
+        return status_code >= 500
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in ("APITimeoutError", "APIConnectionError", "ServiceUnavailable", "DeadlineExceeded")
+
+
+# Common interface for every model backend: generate / agenerate with retries, jittered exponential backoff
+# and a per-provider rate limit. Subclasses implement _generate (and optionally _agenerate and _stream).
+class Provider:
+    name = "base"
+
+    def __init__(self, model: str, temperature: float = 0.0, requests_per_minute: float = None, max_retries: int = 3, base_delay: float = 1.0):
+        self.model = model
+        self.temperature = temperature
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.limiter = RateLimiter(requests_per_minute)
+
+    def _generate(self, prompt: str, **options) -> Generation:
+        raise NotImplementedError
+
+    async def _agenerate(self, prompt: str, **options) -> Generation:
+        return await asyncio.to_thread(self._generate, prompt, **options)
+
+    def _stream(self, prompt: str, **options):
+        # Providers without native streaming hand out the whole answer as a single chunk.
+        yield self._generate(prompt, **options).text
+
+    def backoff_delay(self, attempt: int) -> float:
+        delay = self.base_delay * (2 ** attempt)
+        return delay + random.uniform(0, delay)
+
+    def handle_failure(self, error: Exception, attempt: int) -> float:
+        # Returns how long to wait before retrying, or re-raises when the error is final.
+        if attempt == self.max_retries or not is_retryable_error(error):
+            raise error
+        delay = self.backoff_delay(attempt)
+        if is_rate_limit_error(error):
+            # Throttle every caller of this provider, not just this one
+            self.limiter.pause(delay)
+        return delay
+
+    def generate(self, prompt: str, **options) -> Generation:
+        options.setdefault("temperature", self.temperature)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            started_at = time.perf_counter()
+            try:
+                generation = self._generate(prompt, **options)
+            except Exception as error:
+                time.sleep(self.handle_failure(error, attempt))
+                continue
+            generation.latency_ms = (time.perf_counter() - started_at) * 1000
+            return generation
+
+    # Yields the answer as text chunks while the model produces it. Failures before the first chunk are retried
+    # like generate; once text has been handed out they are raised to the caller.
+    def stream(self, prompt: str, **options):
+        options.setdefault("temperature", self.temperature)
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            chunks = self._stream(prompt, **options)
+            try:
+                first_chunk = next(chunks, None)
+            except Exception as error:
+                time.sleep(self.handle_failure(error, attempt))
+                continue
+            break
+        if first_chunk is not None:
+            yield first_chunk
+        yield from chunks
+
+    async def agenerate(self, prompt: str, **options) -> Generation:
+        options.setdefault("temperature", self.temperature)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.to_thread(self.limiter.acquire)
+            started_at = time.perf_counter()
+            try:
+                generation = await self._agenerate(prompt, **options)
+            except Exception as error:
+                await asyncio.sleep(self.handle_failure(error, attempt))
+                continue
+            generation.latency_ms = (time.perf_counter() - started_at) * 1000
+            return generation
+
+
+class OpenAIProvider(Provider):
+    name = "openai"
+
+    def __init__(self, model: str = "gpt-3.5-turbo", api_key: str = None, **kwargs):
+        super().__init__(model, **kwargs)
+        from openai import AsyncOpenAI, OpenAI
+        from dotenv import load_dotenv
+
+        load_dotenv()
+        api_key = api_key or os.getenv("OPENAI_API_KEY")
+        # One client per provider, so its HTTP connection pool is reused by every call. Retries are handled above.
+        self.client = OpenAI(api_key=api_key, max_retries=0)
+        self.async_client = AsyncOpenAI(api_key=api_key, max_retries=0)
+
+    def build_request(self, prompt: str, options: dict) -> dict:
+        messages = [{"role": "user", "content": prompt}]
+        if options.get("system"):
+            messages.insert(0, {"role": "system", "content": options["system"]})
+        return {"model": self.model, "messages": messages, "temperature": options.get("temperature")}
+
+    def to_generation(self, response) -> Generation:
+        usage = response.usage
+        return Generation(response.choices[0].message.content, self.model,
+                          usage.prompt_tokens if usage else None, usage.completion_tokens if usage else None)
+
+    def _generate(self, prompt: str, **options) -> Generation:
+        return self.to_generation(self.client.chat.completions.create(**self.build_request(prompt, options)))
+
+    async def _agenerate(self, prompt: str, **options) -> Generation:
+        return self.to_generation(await self.async_client.chat.completions.create(**self.build_request(prompt, options)))
+
+    def _stream(self, prompt: str, **options):
+        for chunk in self.client.chat.completions.create(**self.build_request(prompt, options), stream=True):
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+
+class GeminiProvider(Provider):
+    name = "gemini"
+    _configure_lock = threading.Lock()
+    _configured = False
+
+    def __init__(self, model: str = "gemini-1.5-flash", api_key: str = None, **kwargs):
+        super().__init__(model, **kwargs)
+        import google.generativeai as genai
+        from google.generativeai.types import HarmCategory, HarmBlockThreshold
+        from dotenv import load_dotenv
+
+        with GeminiProvider._configure_lock:
+            if not GeminiProvider._configured or api_key:
+                load_dotenv()
+                api_key = api_key or os.environ.get("GEMINI_API_KEY")
+                if not api_key:
+                    raise RuntimeError("GEMINI_API_KEY is not set; it is needed to call Gemini models.")
+                genai.configure(api_key=api_key)
+                GeminiProvider._configured = True
+        self.client = genai.GenerativeModel(model)
+        self.safety_settings = {
+            HarmCategory.HARM_CATEGORY_HATE_SPEECH: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_HARASSMENT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_SEXUALLY_EXPLICIT: HarmBlockThreshold.BLOCK_NONE,
+            HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
+        }
+
+    def to_generation(self, response) -> Generation:
+        usage = getattr(response, "usage_metadata", None)
+        return Generation(response.text, self.model,
+                          usage.prompt_token_count if usage else None, usage.candidates_token_count if usage else None)
+
+    def _generate(self, prompt: str, **options) -> Generation:
+        response = self.client.generate_content(prompt, safety_settings=self.safety_settings,
+                                                generation_config={"temperature": options.get("temperature")})
+        return self.to_generation(response)
+
+    async def _agenerate(self, prompt: str, **options) -> Generation:
+        response = await self.client.generate_content_async(prompt, safety_settings=self.safety_settings,
+                                                            generation_config={"temperature": options.get("temperature")})
+        return self.to_generation(response)
+
+    def _stream(self, prompt: str, **options):
+        response = self.client.generate_content(prompt, safety_settings=self.safety_settings, stream=True,
+                                                generation_config={"temperature": options.get("temperature")})
+        for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+
+
+# Wraps any langchain LLM or chat model so existing langchain setups can be used as a provider.
+class LangChainProvider(Provider):
+    name = "langchain"
+
+    def __init__(self, llm, **kwargs):
+        model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+        kwargs.setdefault("temperature", getattr(llm, "temperature", None))
+        super().__init__(model, **kwargs)
+        self.llm = llm
+
+    def _generate(self, prompt: str, **options) -> Generation:
+        result = self.llm.invoke(prompt)
+        return Generation(getattr(result, "content", result), self.model)
+
+
+# Offline provider for tests and harness benchmarks: deterministic answers, configurable latency and failures.
+# latency is one of ("fixed", ms), ("normal", mean_ms, std_ms), ("lognormal", median_ms, sigma), ("exponential", mean_ms).
+# failure_rate is the share of calls failing with a 503, rate_limit_rate the share failing with a 429.
+# When streamed, the sampled latency is the time to the first word, and every further word takes token_latency_ms.
+# Randomness is derived from (seed, prompt, n-th call with that prompt), so runs are reproducible under any concurrency.
+class MockProvider(Provider):
+    name = "mock"
+
+    def __init__(self, model: str = "mock", latency=("fixed", 0), failure_rate: float = 0.0, rate_limit_rate: float = 0.0, seed: int = 0, respond=None, token_latency_ms: float = 0.0, **kwargs):
+        kwargs.setdefault("base_delay", 0.01)
+        super().__init__(model, **kwargs)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self.token_latency_ms = token_latency_ms
+        self.respond = respond or (lambda prompt: f"mock response {hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12]}")
+        self.calls = 0
+        self.calls_by_prompt = {}
+        self.lock = threading.Lock()
+
+    def sample_latency(self, rng: random.Random) -> float:
+        kind, *params = self.latency
+        if kind == "fixed":
+            return params[0]
+        if kind == "normal":
+            return max(0.0, rng.gauss(params[0], params[1]))
+        if kind == "lognormal":
+            return params[0] * rng.lognormvariate(0, params[1])
+        if kind == "exponential":
+            return rng.expovariate(1 / params[0]) if params[0] else 0.0
+        raise ValueError(f"Unknown latency distribution {kind!r}")
+
+    def next_call(self, prompt: str):
+        with self.lock:
+            self.calls += 1
+            call_number = self.calls_by_prompt.get(prompt, 0)
+            self.calls_by_prompt[prompt] = call_number + 1
+        rng = random.Random(f"{self.seed}:{call_number}:{prompt}")
+        return rng, self.sample_latency(rng) / 1000
+
+    def outcome(self, rng: random.Random, prompt: str) -> Generation:
+        roll = rng.random()
+        if roll < self.rate_limit_rate:
+            raise ProviderError("mock rate limit exceeded", status_code=429)
+        if roll < self.rate_limit_rate + self.failure_rate:
+            raise ProviderError("mock provider unavailable", status_code=503)
+        text = self.respond(prompt)
+        return Generation(text, self.model, len(prompt) // 4 + 1, len(text) // 4 + 1)
+
+    def _generate(self, prompt: str, **options) -> Generation:
+        rng, delay = self.next_call(prompt)
+        time.sleep(delay)
+        return self.outcome(rng, prompt)
+
+    async def _agenerate(self, prompt: str, **options) -> Generation:
+        rng, delay = self.next_call(prompt)
+        await asyncio.sleep(delay)
+        return self.outcome(rng, prompt)
+
+    def _stream(self, prompt: str, **options):
+        rng, delay = self.next_call(prompt)
+        time.sleep(delay)
+        words = self.outcome(rng, prompt).text.split(" ")
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(self.token_latency_ms / 1000)
+            yield word if i == len(words) - 1 else word + " "
+
+
+PROVIDERS = {
+    "openai": OpenAIProvider,
+    "gemini": GeminiProvider,
+    "mock": MockProvider,
+}
+_provider_instances = {}
+_provider_instances_lock = threading.Lock()
+
+
+def register_provider(name: str, provider_class):
+    PROVIDERS[name] = provider_class
+
+
+# Shared provider instance per (provider, model), created on first use so connection pools and rate limits are shared.
+def get_provider(name: str, model: str = None, **kwargs) -> Provider:
+    key = (name, model)
+    with _provider_instances_lock:
+        if key not in _provider_instances:
+            provider_class = PROVIDERS[name]
+            _provider_instances[key] = provider_class(model, **kwargs) if model else provider_class(**kwargs)
+        return _provider_instances[key]
@@ -0,0 +1,44 @@
+import threading
+import time
+
+
+# Token bucket shared between worker threads. requests_per_minute=None means no limit.
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = None, burst: int = None):
+        self.requests_per_minute = requests_per_minute
+        self.rate = requests_per_minute / 60.0 if requests_per_minute else None
+        self.capacity = burst if burst else max(1, int(self.rate)) if self.rate else None
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a request slot is available (and any provider-requested pause has passed).
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                wait = self.paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        # Called when the provider pushes back (HTTP 429); every worker waits, not just the one that was throttled.
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    if getattr(error, "status_code", None) == 429 or getattr(error, "code", None) == 429:
+        return True
+    message = str(error).lower()
+    return "rate limit" in message or "ratelimit" in message or "429" in message or "quota" in message
+
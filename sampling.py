@@ -0,0 +1,32 @@
+import math
+import random
+from statistics import NormalDist
+
+
+# Wilson score interval for a proportion, in percent. Unlike the normal approximation it stays inside 0-100
+# and behaves well for small samples and scores close to 0 or 100.
+def wilson_interval(successes: int, n: int, confidence: float = 0.95) -> tuple:
+    if n == 0:
+        return 0.0, 100.0
+    z = NormalDist().inv_cdf((1 + confidence) / 2)
+    p = successes / n
+    denominator = 1 + z * z / n
+    center = (p + z * z / (2 * n)) / denominator
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / denominator
+    return 100 * max(0.0, center - margin), 100 * min(1.0, center + margin)
+
+
+# Orders items so that every prefix is a random sample stratified by key(item), each stratum in proportion to its size.
+# Items are shuffled within their stratum, then interleaved by their relative position in it.
+def stratified_order(items: list, key, seed: int = None) -> list:
+    rng = random.Random(seed)
+    strata = {}
+    for item in items:
+        strata.setdefault(key(item), []).append(item)
+    positioned = []
+    for stratum in strata.values():
+        rng.shuffle(stratum)
+        offset = rng.random()
+        positioned.extend(((index + offset) / len(stratum), rng.random(), item) for index, item in enumerate(stratum))
+    positioned.sort(key=lambda entry: entry[:2])
+    return [item for _, _, item in positioned]
@@ -0,0 +1,85 @@
+import unittest
+
+from evaluators import AllChecks, JSONCheck, LengthCheck, LexicalSimilarity, RegexCheck, parse_instruction, pipeline_for
+
+
+def decide(how_to_evaluate, output, ground_truth=None):
+    return pipeline_for(how_to_evaluate).evaluate([{"output": output, "ground_truth": ground_truth}])[0]
+
+
+class ParseInstructionTest(unittest.TestCase):
+    def test_length_limit_covers_the_instruction(self):
+        checks, complete = parse_instruction("Make sure it is less than 50 characters")
+        self.assertTrue(complete)
+        self.assertEqual(len(checks), 1)
+        self.assertIsInstance(checks[0], LengthCheck)
+        self.assertEqual(checks[0].max_length, 49)
+
+    def test_number_words_and_word_unit(self):
+        checks, complete = parse_instruction("at most twenty words")
+        self.assertTrue(complete)
+        self.assertEqual((checks[0].max_length, checks[0].unit), (20, "words"))
+
+    def test_quoted_text_keeps_its_case(self):
+        checks, complete = parse_instruction('Must include "MarkLogic"')
+        self.assertTrue(complete)
+        self.assertIsInstance(checks[0], RegexCheck)
+        self.assertIn("MarkLogic", checks[0].pattern.pattern)
+
+    def test_negated_json_is_not_a_complete_json_check(self):
+        checks, complete = parse_instruction("Respond in plain text, not JSON")
+        self.assertFalse(complete)
+
+    def test_question_mentioning_json_is_not_complete(self):
+        checks, complete = parse_instruction("Does the answer explain what JSON is?")
+        self.assertFalse(complete)
+
+    def test_judgement_instruction_has_no_checks(self):
+        self.assertEqual(parse_instruction("Is the output polite?"), ([], False))
+
+
+class PipelineForTest(unittest.TestCase):
+    def test_partly_parsed_instructions_go_to_the_judge(self):
+        self.assertIsNone(decide("Respond in plain text, not JSON", "Just plain text."))
+        self.assertIsNone(decide("Does the answer explain what JSON is?", "JSON is a text format for data."))
+        self.assertIsNone(decide("Be polite and keep it under 10 words", "This answer is definitely longer than ten words, sadly for everyone."))
+
+    def test_complete_instruction_decides_both_ways(self):
+        self.assertEqual(decide("less than 20 characters", "Short."), (True, None, "length"))
+        self.assertFalse(decide("less than 20 characters", "This one is far too long to pass.")[0])
+        self.assertEqual(decide("Respond in valid JSON", '{"a": 1}'), (True, None, "json"))
+        self.assertFalse(decide("Respond in valid JSON", "not json")[0])
+
+    def test_every_check_of_a_complete_instruction_has_to_pass(self):
+        pipeline = pipeline_for('Respond in JSON with at most 30 characters')
+        self.assertIsInstance(pipeline.evaluators[0], AllChecks)
+        self.assertEqual(decide('Respond in JSON with at most 30 characters', '{"a": 1}'), (True, None, "instruction"))
+        self.assertFalse(decide('Respond in JSON with at most 30 characters', '{"answer": "far too long for the limit"}')[0])
+        self.assertFalse(decide('Respond in JSON with at most 30 characters', 'short text')[0])
+
+    def test_ground_truth_uses_exact_match_only(self):
+        self.assertEqual(decide(None, "Hello, world!", "hello world"), (True, None, "exact match"))
+        self.assertIsNone(decide(None, "Bob paid Alice 5 dollars", "Alice paid Bob 5 dollars"))
+
+    def test_missing_output_goes_to_the_judge(self):
+        self.assertIsNone(decide("Make sure it is less than 50 characters", None))
+        self.assertIsNone(decide('Must not contain "sorry"', None))
+        self.assertIsNone(decide(None, None, "hello"))
+
+    def test_incomplete_checks_do_not_decide_on_their_own(self):
+        self.assertEqual(JSONCheck().evaluate([{"output": "plain"}]), [None])
+
+
+class LexicalSimilarityTest(unittest.TestCase):
+    def test_word_sets_ignore_order(self):
+        # Why it is not part of the default pipeline
+        verdict = LexicalSimilarity().evaluate([{"output": "Bob paid Alice 5 dollars", "ground_truth": "Alice paid Bob 5 dollars"}])[0]
+        self.assertEqual(verdict, (True, None))
+
+    def test_negation_is_not_accepted(self):
+        verdict = LexicalSimilarity(accept_above=0.5).evaluate([{"output": "the order has shipped", "ground_truth": "the order has not shipped"}])[0]
+        self.assertIsNone(verdict)
+
+
+if __name__ == "__main__":
+    unittest.main()
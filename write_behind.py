@@ -0,0 +1,95 @@
+import atexit
+import queue
+import threading
+
+BACKPRESSURE_POLICIES = ("block", "drop", "sync")
+
+
+# Bounded queue drained by a background thread that hands records to write_batch in batches.
+# Records are the logger's ("input" | "output", ticket, ...) tuples; an output belongs to the input with the same ticket.
+# When the queue is full, backpressure decides what the caller does:
+#   "block" waits for space, "drop" discards the record (counted in self.dropped) and, for an input, its output too,
+#   "sync" waits for the queued records to be written, then writes the record on the caller's thread,
+#   so an output is never written before its input.
+class WriteBehindQueue:
+    def __init__(self, write_batch, max_queue_size: int = 10000, batch_size: int = 500, backpressure: str = "block"):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"backpressure must be one of {BACKPRESSURE_POLICIES}, got {backpressure!r}")
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.backpressure = backpressure
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.dropped = 0
+        # Tickets of dropped inputs, whose outputs are dropped when they arrive
+        self.dropped_tickets = set()
+        self.lock = threading.Lock()
+        self.written = 0
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, name="llm-logger-writer", daemon=True)
+        self.thread.start()
+        # Make sure queued records reach the database when the program exits normally.
+        atexit.register(self.close)
+
+    def put(self, record):
+        if self.stopped:
+            self.write_batch([record])
+            return
+        kind, ticket = record[0], record[1]
+        if kind == "output" and self.dropped_tickets:
+            with self.lock:
+                if ticket in self.dropped_tickets:
+                    self.dropped_tickets.discard(ticket)
+                    self.dropped += 1
+                    return
+        try:
+            self.queue.put(record, block=self.backpressure == "block")
+        except queue.Full:
+            if self.backpressure == "drop":
+                with self.lock:
+                    self.dropped += 1
+                    if kind == "input":
+                        self.dropped_tickets.add(ticket)
+            else:
+                self.queue.join()
+                self.write_batch([record])
+
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                self.queue.task_done()
+                return
+            batch = [record]
+            stop_after_batch = False
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if record is None:
+                    stop_after_batch = True
+                    break
+                batch.append(record)
+            try:
+                self.write_batch(batch)
+                self.written += len(batch)
+            except Exception as error:
+                print(f"Write-behind logger failed to write {len(batch)} records: {error}")
+            finally:
+                for _ in range(len(batch) + stop_after_batch):
+                    self.queue.task_done()
+            if stop_after_batch:
+                return
+
+    def flush(self):
+        # Blocks until every record queued so far has been written.
+        if not self.stopped:
+            self.queue.join()
+
+    def close(self):
+        if self.stopped:
+            return
+        # Later puts are written synchronously; everything already queued is drained before the writer exits.
+        self.stopped = True
+        self.queue.put(None)
+        self.thread.join()